@@ -1,12 +1,37 @@
-import uuid
-from typing import List, Optional, Literal
+from typing import List
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
 
 import os
 import httpx
+import orjson
+
+from app.models import (
+    QUESTION_LIST,
+    GeneratedQuestion,
+    Lecture,
+    LectureCreateResponse,
+    QuestionGenerationRequest,
+    QuestionGenerationResponse,
+)
+from app.services.admission import llm_gate
+from app.services.batcher import MicroBatcher, question_batch_handler
+from app.services.cache import question_cache
+from app.services.transcription import (
+    TRANSCRIBE_BATCH_URL,
+    shutdown_transcription,
+    transcription_batcher,
+    upload_size,
+)
+
+try:
+    import openai  # type: ignore
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
 
 # ----------------------------------------------------
 # Config
@@ -14,9 +39,28 @@ import httpx
 
 # If you have a separate transcription microservice, point to it here.
 TRANSCRIBE_SERVICE_URL = os.getenv("TRANSCRIBE_SERVICE_URL")  # optional
+# The batched variant (TRANSCRIBE_BATCH_URL) is handled by app.services.transcription.
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Below this there is not enough material to ask meaningful questions about
+MIN_LECTURE_CHARS = 50
+
+# Built once so every generation call shares one async connection pool.
+aclient = (
+    openai.AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        ),
+    )
+    if OPENAI_API_KEY and OPENAI_AVAILABLE
+    else None
+)
 
-app = FastAPI(title="Adaptive AI Exam Portal - Prototype")
+app = FastAPI(
+    title="Adaptive AI Exam Portal - Prototype",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,49 +70,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ----------------------------------------------------
-# In-memory storage (swap to DB later)
-# ----------------------------------------------------
-
-class QuestionType(str):
-    MCQ = "mcq"
-    FILL_BLANK = "fill_blank"
-    SHORT_ANSWER = "short_answer"
 
-
-class MCQOption(BaseModel):
-    text: str
-    is_correct: bool = False
-
-
-class GeneratedQuestion(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    type: Literal["mcq", "fill_blank", "short_answer"]
-    prompt: str
-    options: Optional[List[MCQOption]] = None   # only for MCQ
-    answer: Optional[str] = None                # canonical answer
-    explanation: Optional[str] = None
-    topic: Optional[str] = None
-    difficulty: Optional[Literal["easy", "medium", "hard"]] = None
+@app.on_event("startup")
+async def open_http_client() -> None:
+    # One pooled client for the whole process so uploads reuse TCP/TLS connections.
+    app.state.http = httpx.AsyncClient(
+        timeout=120,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+    )
+    if TRANSCRIBE_BATCH_URL:
+        transcription_batcher.start()
 
 
-class Lecture(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    title: str
-    source_type: Literal["audio", "video", "text"]
-    raw_text: str
-    summary: Optional[str] = None
-    questions: List[GeneratedQuestion] = []
+@app.on_event("shutdown")
+async def close_http_client() -> None:
+    await shutdown_transcription()
+    await app.state.http.aclose()
 
+# ----------------------------------------------------
+# In-memory storage (swap to DB later)
+# ----------------------------------------------------
 
 LECTURES: dict[str, Lecture] = {}  # lecture_id -> Lecture
 
-
 # ----------------------------------------------------
 # Service layer – you can reuse your old logic HERE
 # ----------------------------------------------------
 
-async def transcribe_audio(file: UploadFile) -> str:
+async def transcribe_audio(file: UploadFile, client: httpx.AsyncClient) -> str:
     """
     Transcribe uploaded audio/video into text.
 
@@ -76,13 +106,25 @@ async def transcribe_audio(file: UploadFile) -> str:
     Option B: import and call your local transcription function here.
 
     For now this is written as:
+    - if TRANSCRIBE_BATCH_URL is set, queue the upload so concurrent uploads
+      share one batched request.
     - if TRANSCRIBE_SERVICE_URL is set, call that HTTP endpoint.
     - otherwise, raise an error (you’ll fill this in).
     """
+    # Resolve the UploadFile properties once; both paths send the same part.
+    upload = (file.filename, file.file, file.content_type)
+
+    if TRANSCRIBE_BATCH_URL:
+        # The upload stays open while this request awaits its batch result.
+        await file.seek(0)
+        return await transcription_batcher.submit((*upload, upload_size(file)))
+
     if TRANSCRIBE_SERVICE_URL:
-        async with httpx.AsyncClient(timeout=120) as client:
-            files = {"file": (file.filename, await file.read(), file.content_type)}
-            resp = await client.post(TRANSCRIBE_SERVICE_URL, files=files)
+        # Hand httpx the spooled upload itself so the multipart body is streamed
+        # in chunks instead of materialising the whole file in memory.
+        await file.seek(0)
+        files = {"file": upload}
+        resp = await client.post(TRANSCRIBE_SERVICE_URL, files=files)
         if resp.status_code != 200:
             raise HTTPException(
                 status_code=500,
@@ -113,41 +155,16 @@ async def summarize_text(text: str) -> str:
     return text[:1500]
 
 
-async def generate_questions_from_text(
-    text: str,
-    num_questions: int = 10,
-    mix: dict[str, int] | None = None,
-) -> List[GeneratedQuestion]:
-    """Use GPT (or your own model) to generate structured questions."""
-    if not OPENAI_API_KEY:
-        raise HTTPException(
-            status_code=500,
-            detail="OPENAI_API_KEY not configured for question generation.",
-        )
-
-    mix = mix or {"mcq": int(num_questions * 0.6),
-                  "fill_blank": int(num_questions * 0.2),
-                  "short_answer": num_questions - int(num_questions * 0.6) - int(num_questions * 0.2)}
-
-    import openai  # type: ignore
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
-
-    system_prompt = (
-        "You are an assistant that generates exam questions from lecture text. "
-        "Return STRICT JSON with a list of questions. "
-        "Each question MUST have: type (mcq|fill_blank|short_answer), "
-        "prompt, options (for mcq), answer, explanation, topic, difficulty."
-    )
-
-    user_prompt = f"""
-Lecture content:
-{text[:8000]}
-
-Generate exactly {num_questions} questions using this mix:
-- MCQ: {mix['mcq']}
-- Fill in the blank: {mix['fill_blank']}
-- Short answer: {mix['short_answer']}
+# Static instructions come first and the lecture text last, so repeated calls
+# share the longest possible prompt prefix (OpenAI caches prefix tokens).
+SYSTEM_PROMPT = (
+    "You are an assistant that generates exam questions from lecture text. "
+    "Return STRICT JSON with a list of questions. "
+    "Each question MUST have: type (mcq|fill_blank|short_answer), "
+    "prompt, options (for mcq), answer, explanation, topic, difficulty."
+)
 
+USER_PROMPT_TEMPLATE = """
 Respond in JSON:
 {{
   "questions": [
@@ -163,64 +180,83 @@ Respond in JSON:
     ...
   ]
 }}
+
+Generate exactly {num_questions} questions using this mix:
+- MCQ: {mcq}
+- Fill in the blank: {fill_blank}
+- Short answer: {short_answer}
+
+Lecture content:
+{text}
 """
 
-    resp = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        response_format={"type": "json_object"},
-    )
 
-    content = resp.choices[0].message.content
-    import json
-    data = json.loads(content)
-    questions_raw = data.get("questions", [])
+async def generate_questions_from_text(
+    text: str,
+    num_questions: int = 10,
+    mix: dict[str, int] | None = None,
+) -> List[GeneratedQuestion]:
+    """Use GPT (or your own model) to generate structured questions."""
+    mix = mix or {"mcq": int(num_questions * 0.6),
+                  "fill_blank": int(num_questions * 0.2),
+                  "short_answer": num_questions - int(num_questions * 0.6) - int(num_questions * 0.2)}
 
-    questions: List[GeneratedQuestion] = []
-    for q in questions_raw:
-        q_type = q.get("type", "mcq")
-        options = None
-        if q_type == "mcq":
-            options = [MCQOption(**opt) for opt in q.get("options", [])]
-        questions.append(
-            GeneratedQuestion(
-                type=q_type,
-                prompt=q.get("prompt", ""),
-                options=options,
-                answer=q.get("answer"),
-                explanation=q.get("explanation"),
-                topic=q.get("topic"),
-                difficulty=q.get("difficulty"),
-            )
+    cached = await question_cache.get(text, num_questions, mix)
+    if cached is not None:
+        return cached
+
+    if aclient is None:
+        raise HTTPException(
+            status_code=500,
+            detail="OPENAI_API_KEY not configured for question generation.",
         )
-    return questions
 
+    user_prompt = USER_PROMPT_TEMPLATE.format(
+        num_questions=num_questions,
+        mcq=mix["mcq"],
+        fill_blank=mix["fill_blank"],
+        short_answer=mix["short_answer"],
+        text=text[:8000],
+    )
 
-# ----------------------------------------------------
-# API Schemas
-# ----------------------------------------------------
+    async with llm_gate.slot():
+        resp = await aclient.chat.completions.create(
+            model="gpt-4.1-mini",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt},
+            ],
+            response_format={"type": "json_object"},
+        )
 
-class LectureCreateResponse(BaseModel):
-    lecture_id: str
-    title: str
-    source_type: str
+    content = resp.choices[0].message.content
+    data = orjson.loads(content)
+    questions_raw = data.get("questions", [])
 
+    questions: List[GeneratedQuestion] = QUESTION_LIST.validate_python([
+        {
+            "type": q.get("type", "mcq"),
+            "prompt": q.get("prompt", ""),
+            "options": q.get("options", []) if q.get("type", "mcq") == "mcq" else None,
+            "answer": q.get("answer"),
+            "explanation": q.get("explanation"),
+            "topic": q.get("topic"),
+            "difficulty": q.get("difficulty"),
+        }
+        for q in questions_raw
+    ])
+
+    await question_cache.put(text, num_questions, mix, questions)
+    return questions
 
-class QuestionGenerationRequest(BaseModel):
-    num_questions: int = 10
-    mcq_ratio: float = 0.6
-    fill_blank_ratio: float = 0.2
-    short_answer_ratio: float = 0.2
 
+# Coalesces concurrent lecture creations before they reach the LLM
+question_batcher = MicroBatcher(question_batch_handler(generate_questions_from_text), max_batch=8, max_wait_ms=50)
 
-class QuestionGenerationResponse(BaseModel):
-    lecture_id: str
-    total_questions: int
-    questions: List[GeneratedQuestion]
 
+# ----------------------------------------------------
+# API Schemas
+# ----------------------------------------------------
 
 class LectureDetailResponse(BaseModel):
     lecture: Lecture
@@ -232,6 +268,7 @@ class LectureDetailResponse(BaseModel):
 
 @app.post("/lectures/from-audio", response_model=LectureCreateResponse)
 async def create_lecture_from_audio(
+    request: Request,
     file: UploadFile = File(...),
     title: str = Form("Untitled Lecture"),
 ):
@@ -240,7 +277,7 @@ async def create_lecture_from_audio(
     2) Transcribe to text.
     3) Store lecture with summary.
     """
-    transcript = await transcribe_audio(file)
+    transcript = await transcribe_audio(file, request.app.state.http)
     summary = await summarize_text(transcript)
 
     lecture = Lecture(
@@ -283,19 +320,35 @@ async def create_lecture_from_text(
 @app.post(
     "/lectures/{lecture_id}/generate-questions",
     response_model=QuestionGenerationResponse,
+    response_model_exclude_none=True,
 )
 async def generate_questions_for_lecture(
     lecture_id: str,
     req: QuestionGenerationRequest,
+    include_questions: bool = False,
 ):
+    # Reject malformed requests before paying for an LLM round-trip
+    n = req.num_questions
+    if n <= 0:
+        raise HTTPException(status_code=422, detail="num_questions must be positive.")
+
     lecture = LECTURES.get(lecture_id)
     if not lecture:
         raise HTTPException(status_code=404, detail="Lecture not found.")
+    if len(lecture.raw_text.strip()) < MIN_LECTURE_CHARS:
+        raise HTTPException(
+            status_code=422,
+            detail="Lecture text is too short to generate questions from.",
+        )
 
-    n = req.num_questions
     mcq = int(n * req.mcq_ratio)
     fill_b = int(n * req.fill_blank_ratio)
     short = n - mcq - fill_b
+    if mcq < 0 or fill_b < 0 or short < 0:
+        # Ratios that don't add up: fall back to the default 60/20/20 split
+        mcq = int(n * 0.6)
+        fill_b = int(n * 0.2)
+        short = n - mcq - fill_b
     mix = {"mcq": mcq, "fill_blank": fill_b, "short_answer": short}
 
     questions = await generate_questions_from_text(
@@ -304,12 +357,12 @@ async def generate_questions_for_lecture(
         mix=mix,
     )
     lecture.questions = questions
-    LECTURES[lecture_id] = lecture
+    lecture.index_questions()
 
     return QuestionGenerationResponse(
         lecture_id=lecture.id,
         total_questions=len(questions),
-        questions=questions,
+        questions=questions if include_questions else None,
     )
 
 
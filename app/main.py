@@ -1,22 +1,30 @@
-from typing import Optional, List, Dict, Any
-import uuid
+from typing import Optional, List, Dict, Any, Tuple
+import time
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import orjson
+from pathlib import Path
 from pydantic import BaseModel
 from datetime import datetime
-from app.models import Lecture, GeneratedQuestion
-from app.services.transcription import transcribe_audio
+from app.models import Lecture, GeneratedQuestion, new_id
+from app.services.transcription import (
+    ASSEMBLYAI_API_KEY,
+    shutdown_transcription,
+    transcribe_audio,
+    transcribe_with_assemblyai_advanced,
+)
 from app.routers import lectures
-from app.services.question_generator import summarize_text
-from app.app import generate_questions_from_text
+from app.routers.lectures import proctoring_flag_batcher
+from app.services.question_generator import summarize_text, qgen_batcher
+from app.services.proctoring import proctoring_engine
+from app.app import question_batcher
 
-# Reuse the in-memory stores from lectures.py
+from app.services import store
+# Reuse the helpers from lectures.py
 from app.routers.lectures import (
-    LECTURES,
-    SESSIONS,
     TestSession,
     AnswerRecord,
     select_next_question,
@@ -28,7 +36,8 @@ from app.routers.lectures import (
 app = FastAPI(
     title="Adaptive AI Exam Portal",
     description="An AI-driven examination portal with adaptive testing and proctoring",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # CORS middleware
@@ -46,37 +55,76 @@ try:
 except:
     pass  # Optional for API-only
 
-# Include routers - FIXED: Use /api prefix to match frontend
-app.include_router(lectures.router, prefix="/api/lectures", tags=["lectures"])
+
+# HTML pages are static for the life of the process: locate them once and
+# serve them with FileResponse (sendfile where the platform supports it).
+TEMPLATE_DIR = Path("templates")
+TEMPLATES: Dict[str, Path] = {}
+
+
+@app.on_event("startup")
+async def load_templates() -> None:
+    for name in ("index", "exam", "analytics", "results"):
+        path = TEMPLATE_DIR / f"{name}.html"
+        if path.exists():
+            TEMPLATES[name] = path
+
+
+@app.on_event("shutdown")
+async def stop_batchers() -> None:
+    await question_batcher.stop()
+    await qgen_batcher.stop()
+    await proctoring_flag_batcher.stop()
+    await shutdown_transcription()
+    await store.close_stores()
+
+
+def page_response(name: str, fallback: str):
+    path = TEMPLATES.get(name)
+    if path is None:
+        return HTMLResponse(content=fallback)
+    return FileResponse(path, media_type="text/html")
 
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve the main landing page."""
-    try:
-        with open("templates/index.html", "r") as f:
-            return HTMLResponse(content=f.read())
-    except FileNotFoundError:
-        return HTMLResponse(content="<h1>Welcome to Adaptive AI Exam Portal</h1><p>API running at /docs</p>")
+    return page_response("index", "<h1>Welcome to Adaptive AI Exam Portal</h1><p>API running at /docs</p>")
 
 
 # -------------------------------------------------------------------
 # Additional API endpoints for frontend
 # -------------------------------------------------------------------
 
+# Serialized GET /api/lectures body as (lectures_version, built_at, body).
+# Rebuilt after any lecture write in this process; the TTL bounds how long
+# writes made by other workers can go unseen.
+LECTURE_LIST_TTL = 5.0
+_lectures_cache: Optional[Tuple[int, float, bytes]] = None
+
+
 @app.get("/api/lectures")
-def api_list_lectures():
+async def api_list_lectures():
     """List all lectures for the frontend."""
-    return [
-        {
-            "id": lec_id,
-            "title": lec.title,
-            "summary": lec.summary,
-            "source_type": lec.source_type,
-            "question_count": len(lec.questions),
-        }
-        for lec_id, lec in LECTURES.items()
-    ]
+    global _lectures_cache
+    version, now = store.lectures_version, time.monotonic()
+    if (
+        _lectures_cache is None
+        or _lectures_cache[0] != version
+        or now - _lectures_cache[1] > LECTURE_LIST_TTL
+    ):
+        body = orjson.dumps([
+            {
+                "id": lec.id,
+                "title": lec.title,
+                "summary": lec.summary,
+                "source_type": lec.source_type,
+                "question_count": len(lec.questions),
+            }
+            for lec in await store.lectures_store.values()
+        ])
+        _lectures_cache = (version, now, body)
+    return Response(content=_lectures_cache[2], media_type="application/json")
 
 
 class ApiTranscribeResponse(BaseModel):
@@ -95,13 +143,9 @@ async def api_transcribe(
 ):
     """Transcribe audio/video file with optional advanced features."""
     if speaker_labels or auto_chapters:
-        from app.services.transcription import transcribe_with_assemblyai_advanced
-        api_key = os.environ.get("ASSEMBLYAI_API_KEY")
-        content = await file.read()
         transcript = await transcribe_with_assemblyai_advanced(
-            content, 
-            file.filename,
-            api_key,
+            file,
+            ASSEMBLYAI_API_KEY,
             speaker_labels=speaker_labels,
             auto_chapters=auto_chapters
         )
@@ -114,7 +158,7 @@ async def api_transcribe(
         raw_text=transcript,
         summary=None,
     )
-    LECTURES[lecture.id] = lecture
+    await store.put_lecture(lecture)
 
     return ApiTranscribeResponse(
         lecture_id=lecture.id,
@@ -132,17 +176,32 @@ class StartExamRequest(BaseModel):
 class StartExamResponse(BaseModel):
     session_id: str
     total_questions: int
-    first_question: Dict[str, Any]  # Changed from GeneratedQuestion to Dict
+    first_question: GeneratedQuestion
     
 class GetQuestionResponse(BaseModel):
-    question: Dict[str, Any]
+    question: GeneratedQuestion
     total_questions: int
     question_number: int
 
-@app.post("/api/lectures")
+
+class CreateLectureResponse(BaseModel):
+    lecture_id: str
+    title: str
+    questions_generated: int
+    total_questions: int
+    # The UI only shows the count; the list is served by GET /api/lectures/{id}
+    questions: Optional[List[GeneratedQuestion]] = None
+
+
+@app.post(
+    "/api/lectures",
+    response_model=CreateLectureResponse,
+    response_model_exclude_none=True,
+)
 async def api_create_lecture(
     title: str = Form(...),
     content: str = Form(...),
+    include_questions: bool = False,
 ):
     """Create lecture and generate questions - WITH ERROR HANDLING."""
     try:
@@ -157,7 +216,6 @@ async def api_create_lecture(
             raw_text=content,
             summary=summary,
         )
-        LECTURES[lecture.id] = lecture
         print(f"Lecture created with ID: {lecture.id}")
         
         # Generate questions
@@ -168,25 +226,25 @@ async def api_create_lecture(
         mix = {"mcq": mcq, "fill_blank": fill_b, "short_answer": short}
         
         print(f"Generating {num_questions} questions...")
-        questions = await generate_questions_from_text(
-            text=lecture.raw_text,
-            num_questions=num_questions,
-            mix=mix
-        )
+        questions = await question_batcher.submit((lecture.raw_text, num_questions, mix))
         
         lecture.questions = questions
-        LECTURES[lecture.id] = lecture
+        lecture.index_questions()
+        # Persist once, after the lecture is complete
+        await store.put_lecture(lecture)
         
         print(f"Generated {len(questions)} questions successfully")
         
-        return {
-            "lecture_id": lecture.id,
-            "title": lecture.title,
-            "questions_generated": len(questions),
-            "total_questions": len(questions),
-            "questions": [q.dict() for q in questions],
-        }
+        return CreateLectureResponse(
+            lecture_id=lecture.id,
+            title=lecture.title,
+            questions_generated=len(questions),
+            total_questions=len(questions),
+            questions=questions if include_questions else None,
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR creating lecture: {str(e)}")
         import traceback
@@ -196,14 +254,14 @@ async def api_create_lecture(
 @app.post("/api/exams/start", response_model=StartExamResponse)
 async def api_start_exam(req: StartExamRequest):
     """Start an exam session."""
-    lecture = LECTURES.get(req.lecture_id)
+    lecture = await store.get_lecture(req.lecture_id)
     if not lecture or not lecture.questions:
         raise HTTPException(
             status_code=400,
             detail="Lecture not found or no questions generated yet.",
         )
 
-    session_id = str(uuid.uuid4())
+    session_id = new_id()
     session = TestSession(
         id=session_id,
         lecture_id=req.lecture_id,
@@ -215,11 +273,10 @@ async def api_start_exam(req: StartExamRequest):
     if not first_q:
         raise HTTPException(status_code=400, detail="No questions available.")
 
-    SESSIONS[session_id] = session
+    await store.put_session(session)
     
     # Initialize proctoring for this session
     try:
-        from app.services.proctoring import proctoring_engine
         proctoring_engine.start_proctoring_session(session_id)
         print(f"✓ Proctoring initialized for session {session_id}")
     except Exception as e:
@@ -228,17 +285,17 @@ async def api_start_exam(req: StartExamRequest):
     return StartExamResponse(
         session_id=session_id,
         total_questions=len(lecture.questions),
-        first_question=first_q.dict(),
+        first_question=first_q,
     )
 
 @app.get("/api/exams/{session_id}/question", response_model=GetQuestionResponse)
 async def api_get_current_question(session_id: str):
     """Get the current question for an active exam session."""
-    session = SESSIONS.get(session_id)
+    session = await store.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
 
-    lecture = LECTURES.get(session.lecture_id)
+    lecture = await store.get_lecture(session.lecture_id)
     if not lecture:
         raise HTTPException(status_code=404, detail="Lecture not found.")
 
@@ -251,7 +308,7 @@ async def api_get_current_question(session_id: str):
     question_number = session.total_answered + 1
 
     return GetQuestionResponse(
-        question=current_q.dict(),
+        question=current_q,
         total_questions=len(lecture.questions),
         question_number=question_number
     )
@@ -273,11 +330,11 @@ class SubmitExamAnswerResponse(BaseModel):
 @app.post("/api/exams/{session_id}/answer", response_model=SubmitExamAnswerResponse)
 async def api_answer_exam(session_id: str, req: SubmitExamAnswerRequest):
     """Submit an answer."""
-    session = SESSIONS.get(session_id)
+    session = await store.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
 
-    lecture = LECTURES.get(session.lecture_id)
+    lecture = await store.get_lecture(session.lecture_id)
     if not lecture:
         raise HTTPException(status_code=404, detail="Lecture not found.")
 
@@ -285,27 +342,19 @@ async def api_answer_exam(session_id: str, req: SubmitExamAnswerRequest):
 
     # Evaluate correctness
     is_correct = False
-    correct_answer_text = question.answer
+    correct_answer_text = question.canonical_correct_text
 
     if question.type == "mcq":
-        chosen = normalize_text(req.student_answer)
-        is_correct = any(
-            opt.is_correct and normalize_text(opt.text) == chosen
-            for opt in (question.options or [])
-        )
-        for opt in question.options or []:
-            if opt.is_correct:
-                correct_answer_text = opt.text
-                break
+        is_correct = normalize_text(req.student_answer) in question._normalized_correct
     else:
-        is_correct = normalize_text(req.student_answer) == normalize_text(question.answer)
+        is_correct = normalize_text(req.student_answer) == question._normalized_answer
 
     # Update session
     session.total_answered += 1
     if is_correct:
         session.correct_count += 1
 
-    session.answers.append(
+    session.record_answer(
         AnswerRecord(
             question_id=question.id,
             is_correct=is_correct,
@@ -322,11 +371,10 @@ async def api_answer_exam(session_id: str, req: SubmitExamAnswerRequest):
 
     # ⭐ ADD THIS: Mark session as completed when exam finishes
     if finished:
-        from datetime import datetime
-        session.completed_at = datetime.now()
+        session.complete()
         print(f"✓ Session {session_id} completed at {session.completed_at}")
 
-    SESSIONS[session.id] = session
+    await store.put_session(session)
 
     result_payload = {
         "correct": is_correct,
@@ -335,42 +383,37 @@ async def api_answer_exam(session_id: str, req: SubmitExamAnswerRequest):
         "score": score,
     }
 
-    return SubmitExamAnswerResponse(
-        result=result_payload,
-        exam_complete=finished,
-        final_score=score if finished else None,
-        next_question=next_q.dict() if next_q else None,
-    )
+    # Hottest endpoint: serialize directly instead of validating the response
+    # model a second time (response_model stays for the OpenAPI schema).
+    return ORJSONResponse({
+        "result": result_payload,
+        "exam_complete": finished,
+        "final_score": score if finished else None,
+        "next_question": next_q.model_dump() if next_q else None,
+    })
 
 
 @app.get("/exam", response_class=HTMLResponse)
 async def exam_page():
     """Serve the exam page."""
-    try:
-        with open("templates/exam.html", "r") as f:
-            return HTMLResponse(content=f.read())
-    except FileNotFoundError:
-        return HTMLResponse(content="<h1>Exam Page</h1>")
+    return page_response("exam", "<h1>Exam Page</h1>")
 
 
 @app.get("/analytics", response_class=HTMLResponse)
 async def analytics_page():
     """Serve analytics page."""
-    try:
-        with open("templates/analytics.html", "r") as f:
-            return HTMLResponse(content=f.read())
-    except FileNotFoundError:
-        return HTMLResponse(content="<h1>Analytics Dashboard</h1>")
+    return page_response("analytics", "<h1>Analytics Dashboard</h1>")
 
 
 @app.get("/results", response_class=HTMLResponse)
 async def results_page():
     """Serve results page."""
-    try:
-        with open("templates/results.html", "r") as f:
-            return HTMLResponse(content=f.read())
-    except FileNotFoundError:
-        return HTMLResponse(content="<h1>Results Page</h1>")
+    return page_response("results", "<h1>Results Page</h1>")
+
+
+# GET /api/lectures (the list the frontend reads) is api_list_lectures above;
+# the router only serves the per-lecture, session and analytics routes.
+app.include_router(lectures.router, prefix="/api/lectures", tags=["lectures"])
 
 
 @app.get("/health")
@@ -382,4 +425,15 @@ async def health_check():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
+    dev = os.environ.get("DEV") == "1"
+    # One worker by default: even with Redis, proctoring, analytics and the
+    # question/lecture-list caches are still per process.
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=1 if dev else int(os.environ.get("WEB_CONCURRENCY", 1)),
+        reload=dev,
+    )
\ No newline at end of file
@@ -1,8 +1,52 @@
+import unicodedata
 import uuid
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import List, Optional, Literal, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, TypeAdapter
 from datetime import datetime
 
+import numpy as np
+
+# Optional: Rust-backed UUID generation (time-ordered UUID7)
+try:
+    import uuid_utils
+    UUID_UTILS_AVAILABLE = True
+except ImportError:
+    UUID_UTILS_AVAILABLE = False
+
+
+def new_id() -> str:
+    """Generate a new record id (32-char hex UUID, no hyphens)."""
+    if UUID_UTILS_AVAILABLE:
+        return uuid_utils.uuid7().hex
+    return uuid.uuid4().hex
+
+
+# NFKC folds compatibility forms (full-width letters/digits, ligatures) and
+# casefold() is the Unicode-aware lower(), so e.g. "ＡＢＣ" matches "abc".
+def _normalize(s: str) -> str:
+    if s.isascii():
+        # NFKC leaves ASCII unchanged and casefold() equals lower() on it
+        return s.lower().strip()
+    return unicodedata.normalize("NFKC", s).casefold().strip()
+
+
+# MCQ answers arrive as one of a handful of short option texts, so those are
+# memoized; longer free-text answers are rarely repeated and would only churn
+# the cache, so they are normalized directly.
+_CACHED_MAX_LEN = 200
+_normalize_cached = lru_cache(maxsize=4096)(_normalize)
+
+
+def normalize_text(s: Optional[str]) -> str:
+    if not s:
+        return ""
+    if len(s) <= _CACHED_MAX_LEN:
+        return _normalize_cached(s)
+    return _normalize(s)
+
 
 # ============================================================================
 # Question Models (Your existing models + enhancements)
@@ -14,7 +58,7 @@ class MCQOption(BaseModel):
 
 
 class GeneratedQuestion(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     type: Literal["mcq", "fill_blank", "short_answer"]
     prompt: str
     options: Optional[List[MCQOption]] = None
@@ -23,13 +67,40 @@ class GeneratedQuestion(BaseModel):
     topic: Optional[str] = None
     difficulty: Optional[Literal["easy", "medium", "hard"]] = None
 
+    # Text shown as "correct answer" after grading (the first correct MCQ
+    # option, else `answer`), and the normalized text of the correct MCQ
+    # option(s) and of `answer`, precomputed for grading
+    _canonical_correct_text: Optional[str] = PrivateAttr(default=None)
+    _normalized_correct: frozenset = PrivateAttr(default=frozenset())
+    _normalized_answer: str = PrivateAttr(default="")
+
+    def model_post_init(self, __context: Any) -> None:
+        self._canonical_correct_text = next(
+            (opt.text for opt in self.options or [] if opt.is_correct),
+            self.answer,
+        )
+        self._normalized_answer = normalize_text(self.answer)
+        if self.options:
+            self._normalized_correct = frozenset(
+                normalize_text(opt.text) for opt in self.options if opt.is_correct
+            )
+
+    @property
+    def canonical_correct_text(self) -> Optional[str]:
+        return self._canonical_correct_text
+
+
+# Validates a whole list of questions (LLM output, cache entries) in one pass
+# through pydantic-core.
+QUESTION_LIST = TypeAdapter(List[GeneratedQuestion])
+
 
 # ============================================================================
 # Lecture Models
 # ============================================================================
 
 class Lecture(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     title: str
     source_type: Literal["audio", "video", "text"]
     raw_text: str
@@ -37,12 +108,31 @@ class Lecture(BaseModel):
     questions: List[GeneratedQuestion] = []
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
 
+    # Questions keyed by id for answer lookups, and grouped by difficulty
+    # for adaptive selection
+    _by_id: Dict[str, GeneratedQuestion] = PrivateAttr(default_factory=dict)
+    _by_difficulty: Dict[Optional[str], List[GeneratedQuestion]] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context: Any) -> None:
+        self.index_questions()
+
+    def index_questions(self) -> None:
+        """Rebuild the question indexes; call after replacing `questions`."""
+        buckets: Dict[Optional[str], List[GeneratedQuestion]] = {}
+        for q in self.questions:
+            buckets.setdefault(q.difficulty, []).append(q)
+        self._by_difficulty = buckets
+        self._by_id = {q.id: q for q in self.questions}
+
 
 # ============================================================================
 # Test Session & Answer Models (Your existing models)
 # ============================================================================
 
-class AnswerRecord(BaseModel):
+# Appended once per submitted answer: a slotted dataclass skips per-instance
+# validation and __dict__. TestSession still validates/serializes it as a field.
+@dataclass(slots=True)
+class AnswerRecord:
     question_id: str
     is_correct: bool
     learner_answer: Optional[str] = None
@@ -51,6 +141,60 @@ class AnswerRecord(BaseModel):
     time_spent: Optional[int] = None  # seconds
 
 
+DIFFICULTY_LEVELS = ("easy", "medium", "hard")
+_DIFFICULTY_CODES = {level: code for code, level in enumerate(DIFFICULTY_LEVELS)}
+
+
+class AnswerColumns:
+    """
+    Column-wise copy of a session's answers for analytics.
+
+    `difficulty` holds the index into DIFFICULTY_LEVELS (-1 when unknown) and
+    `time_spent` is NaN when not reported. Arrays grow by doubling; only the
+    first `n` rows are valid, so read them through the properties.
+    """
+
+    __slots__ = ("n", "_is_correct", "_difficulty", "_time_spent")
+
+    def __init__(self, capacity: int = 16):
+        self.n = 0
+        self._is_correct = np.zeros(capacity, dtype=np.bool_)
+        self._difficulty = np.full(capacity, -1, dtype=np.int8)
+        self._time_spent = np.full(capacity, np.nan, dtype=np.float32)
+
+    def append(self, record: "AnswerRecord") -> None:
+        if self.n == len(self._is_correct):
+            capacity = 2 * self.n
+            for name, fill in (("_is_correct", False), ("_difficulty", -1), ("_time_spent", np.nan)):
+                old = getattr(self, name)
+                grown = np.full(capacity, fill, dtype=old.dtype)
+                grown[: self.n] = old
+                setattr(self, name, grown)
+
+        i = self.n
+        self._is_correct[i] = record.is_correct
+        self._difficulty[i] = _DIFFICULTY_CODES.get(record.difficulty, -1)
+        if record.time_spent is not None:
+            self._time_spent[i] = record.time_spent
+        self.n += 1
+
+    @property
+    def is_correct(self) -> np.ndarray:
+        return self._is_correct[: self.n]
+
+    @property
+    def difficulty(self) -> np.ndarray:
+        return self._difficulty[: self.n]
+
+    @property
+    def time_spent(self) -> np.ndarray:
+        return self._time_spent[: self.n]
+
+
+# Newest proctoring flags kept on a session; per-type totals cover the rest
+MAX_PROCTORING_FLAGS = 500
+
+
 class TestSession(BaseModel):
     id: str
     lecture_id: str
@@ -61,7 +205,64 @@ class TestSession(BaseModel):
     total_answered: int = 0
     started_at: Optional[datetime] = Field(default_factory=datetime.now)
     completed_at: Optional[datetime] = None
+    # Used by the in-memory store; the Redis store keeps flags and counts in
+    # separate keys (see store.add_proctoring_flags)
     proctoring_flags: List[Dict[str, Any]] = []
+    # Flag type -> count over the whole session, including trimmed flags
+    proctoring_counts: Dict[str, int] = {}
+
+    # Derived from `answers`, so rebuilt on load rather than serialized:
+    # ids of answered questions for O(1) "already answered?" checks, the
+    # correctness of the last 3 answers (and how many of them were correct)
+    # for the difficulty ladder, and a columnar copy of the answers for
+    # analytics.
+    _answered_ids: set = PrivateAttr(default_factory=set)
+    _recent: deque = PrivateAttr(default_factory=lambda: deque(maxlen=3))
+    _recent_correct: int = PrivateAttr(default=0)
+    _columns: AnswerColumns = PrivateAttr(default_factory=AnswerColumns)
+    # Question selection cursors: bucket key -> (question list, index of the
+    # first question in it that may still be unanswered)
+    _cursors: Dict[Any, tuple] = PrivateAttr(default_factory=dict)
+    # completed_at.isoformat(), formatted once for the polled session endpoints
+    _completed_iso: Optional[str] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._answered_ids = {a.question_id for a in self.answers}
+        self._recent = deque((a.is_correct for a in self.answers[-3:]), maxlen=3)
+        self._recent_correct = sum(self._recent)
+        self._columns = AnswerColumns(max(16, len(self.answers)))
+        for a in self.answers:
+            self._columns.append(a)
+
+    def record_answer(self, record: AnswerRecord) -> None:
+        """Append an answer and keep the derived lookups in step."""
+        self.answers.append(record)
+        self._answered_ids.add(record.question_id)
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_correct -= self._recent[0]
+        self._recent.append(record.is_correct)
+        self._recent_correct += record.is_correct
+        self._columns.append(record)
+
+    def add_proctoring_flags(self, flags: List[Dict[str, Any]]) -> None:
+        """Append flags, counting them by type and keeping only the newest."""
+        counts = self.proctoring_counts
+        for flag in flags:
+            counts[flag["type"]] = counts.get(flag["type"], 0) + 1
+        self.proctoring_flags.extend(flags)
+        if len(self.proctoring_flags) > MAX_PROCTORING_FLAGS:
+            del self.proctoring_flags[:-MAX_PROCTORING_FLAGS]
+
+    def complete(self) -> None:
+        """Mark the session finished now."""
+        self.completed_at = datetime.now()
+        self._completed_iso = self.completed_at.isoformat()
+
+    @property
+    def completed_iso(self) -> Optional[str]:
+        if self._completed_iso is None and self.completed_at is not None:
+            self._completed_iso = self.completed_at.isoformat()
+        return self._completed_iso
 
 
 # ============================================================================
@@ -77,8 +278,7 @@ class ProctoringEvent(BaseModel):
 
     def __init__(self, **data):
         if not data.get("timestamp"):
-            from datetime import datetime
-            data["timestamp"] = datetime.now().isoformat()
+            data["timestamp"] = datetime.now()
         super().__init__(**data)
         
 class ProctoringReport(BaseModel):
@@ -135,7 +335,7 @@ class QuestionGenerationRequest(BaseModel):
 class QuestionGenerationResponse(BaseModel):
     lecture_id: str
     total_questions: int
-    questions: List[GeneratedQuestion]
+    questions: Optional[List[GeneratedQuestion]] = None  # only with ?include_questions=true
 
 
 class SessionStartRequest(BaseModel):
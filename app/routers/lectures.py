@@ -1,9 +1,9 @@
 from typing import List, Optional, Dict
-import uuid
-from datetime import datetime
 from collections import defaultdict
 from typing import Dict, List
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, UploadFile, File, Form, HTTPException
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
 
 from app.models import (
     Lecture, GeneratedQuestion, MCQOption,
@@ -12,29 +12,51 @@ from app.models import (
     AnswerQuestionRequest, AnswerQuestionResponse,
     TestSession, AnswerRecord,
     ProctoringEvent, ProctoringReport,
-    StudentAnalytics, ClassAnalytics
+    StudentAnalytics, ClassAnalytics,
+    normalize_text,
+    new_id,
 )
 from app.services.transcription import transcribe_audio
-from app.services.question_generator import summarize_text, generate_questions_from_text
-from app.services.proctoring import ProctoringEngine
+from app.services.question_generator import summarize_text, qgen_batcher
+from app.services.proctoring import proctoring_engine
 from app.services.analytics import AnalyticsEngine
+from app.services import store
+from app.services.batcher import MicroBatcher
+
+# Optional: binary analytics responses for dashboard clients
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
 
 from app.models import ProctoringEvent
 
 router = APIRouter()
 
-# ============================================================================
-# In-memory stores
-# ============================================================================
+# Initialize service engines (proctoring state is shared with app.main)
+analytics_engine = AnalyticsEngine()
 
-LECTURES: Dict[str, Lecture] = {}
-SESSIONS: Dict[str, TestSession] = {}
+# One step up / down the ladder, saturating at the ends
+_UP = {"easy": "medium", "medium": "hard", "hard": "hard"}
+_DOWN = {"easy": "easy", "medium": "easy", "hard": "medium"}
 
-# Initialize service engines
-proctoring_engine = ProctoringEngine()
-analytics_engine = AnalyticsEngine()
+# Below this there is not enough material to ask meaningful questions about
+MIN_LECTURE_CHARS = 50
 
-DIFFICULTY_ORDER = ["easy", "medium", "hard"]
+# Session-results proctoring fallbacks; shared, so never mutate them
+_NO_PROCTORING = {
+    "integrity_score": 100,
+    "risk_level": "low",
+    "total_events": 0,
+    "recommendations": ("✓ No proctoring data available",),
+}
+_UNAVAILABLE_PROCTORING = {
+    "integrity_score": 100,
+    "risk_level": "low",
+    "total_events": 0,
+    "recommendations": ("Proctoring data unavailable",),
+}
 
 
 # ============================================================================
@@ -42,14 +64,28 @@ DIFFICULTY_ORDER = ["easy", "medium", "hard"]
 # ============================================================================
 
 def get_question_by_id(lecture: Lecture, question_id: str) -> GeneratedQuestion:
-    for q in lecture.questions:
-        if q.id == question_id:
-            return q
-    raise HTTPException(status_code=404, detail="Question not found in lecture.")
+    question = lecture._by_id.get(question_id)
+    if question is None:
+        raise HTTPException(status_code=404, detail="Question not found in lecture.")
+    return question
 
 
-def question_already_answered(session: TestSession, question_id: str) -> bool:
-    return any(a.question_id == question_id for a in session.answers)
+def _first_unanswered(
+    session: TestSession, key, questions: List[GeneratedQuestion]
+) -> Optional[GeneratedQuestion]:
+    """
+    First unanswered question in `questions`, resuming from the session's
+    cursor for this list. Answers are never removed, so everything before
+    the cursor stays answered and each question is skipped at most once.
+    """
+    answered = session._answered_ids
+    seen, pos = session._cursors.get(key, (None, 0))
+    if seen is not questions:
+        pos = 0  # questions were regenerated (or first visit)
+    while pos < len(questions) and questions[pos].id in answered:
+        pos += 1
+    session._cursors[key] = (questions, pos)
+    return questions[pos] if pos < len(questions) else None
 
 
 def select_next_question(lecture: Lecture, session: TestSession) -> Optional[GeneratedQuestion]:
@@ -60,24 +96,14 @@ def select_next_question(lecture: Lecture, session: TestSession) -> Optional[Gen
     - If all answered, return None.
     """
     # 1) try same difficulty
-    candidates = [
-        q for q in lecture.questions
-        if q.difficulty == session.current_difficulty
-        and not question_already_answered(session, q.id)
-    ]
-    if candidates:
-        return candidates[0]
-
-    # 2) any unanswered
-    remaining = [
-        q for q in lecture.questions
-        if not question_already_answered(session, q.id)
-    ]
-    if remaining:
-        return remaining[0]
+    bucket = lecture._by_difficulty.get(session.current_difficulty)
+    if bucket:
+        q = _first_unanswered(session, session.current_difficulty, bucket)
+        if q is not None:
+            return q
 
-    # 3) no questions left
-    return None
+    # 2) any unanswered; 3) None when no questions are left
+    return _first_unanswered(session, "*", lecture.questions)
 
 
 def update_difficulty(session: TestSession) -> None:
@@ -86,24 +112,17 @@ def update_difficulty(session: TestSession) -> None:
     - accuracy >= 0.8 -> move up a level (easy -> medium -> hard)
     - accuracy <= 0.5 -> move down a level (hard -> medium -> easy)
     """
-    if not session.answers:
+    window = session._recent
+    if not window:
         return
 
-    window = session.answers[-3:]
-    correct = sum(1 for a in window if a.is_correct)
-    accuracy = correct / len(window)
+    accuracy = session._recent_correct / len(window)
 
-    current_idx = DIFFICULTY_ORDER.index(session.current_difficulty) \
-        if session.current_difficulty in DIFFICULTY_ORDER else 1
-
-    if accuracy >= 0.8 and current_idx < len(DIFFICULTY_ORDER) - 1:
-        session.current_difficulty = DIFFICULTY_ORDER[current_idx + 1]
-    elif accuracy <= 0.5 and current_idx > 0:
-        session.current_difficulty = DIFFICULTY_ORDER[current_idx - 1]
-
-
-def normalize_text(s: Optional[str]) -> str:
-    return (s or "").strip().lower()
+    # Unknown levels are treated as "medium", as before
+    if accuracy >= 0.8:
+        session.current_difficulty = _UP.get(session.current_difficulty, "hard")
+    elif accuracy <= 0.5:
+        session.current_difficulty = _DOWN.get(session.current_difficulty, "easy")
 
 
 # ============================================================================
@@ -125,7 +144,7 @@ async def create_lecture_from_audio(
         raw_text=transcript,
         summary=summary,
     )
-    LECTURES[lecture.id] = lecture
+    await store.put_lecture(lecture)
 
     return LectureCreateResponse(
         lecture_id=lecture.id,
@@ -147,7 +166,7 @@ async def create_lecture_from_text(
         raw_text=content,
         summary=summary,
     )
-    LECTURES[lecture.id] = lecture
+    await store.put_lecture(lecture)
 
     return LectureCreateResponse(
         lecture_id=lecture.id,
@@ -160,49 +179,62 @@ async def transcribe_endpoint(file: UploadFile):
     text = await transcribe_audio(file)
     return {"text": text}
 
-@router.post("/{lecture_id}/generate-questions", response_model=QuestionGenerationResponse)
-async def generate_questions_for_lecture(lecture_id: str, req: QuestionGenerationRequest):
-    """Generate questions for a lecture using AI."""
-    lecture = LECTURES.get(lecture_id)
+@router.post(
+    "/{lecture_id}/generate-questions",
+    response_model=QuestionGenerationResponse,
+    response_model_exclude_none=True,
+)
+async def generate_questions_for_lecture(
+    lecture_id: str,
+    req: QuestionGenerationRequest,
+    include_questions: bool = False,
+):
+    """
+    Generate questions for a lecture using AI.
+
+    Only the count is returned unless `include_questions` is set; the full
+    list is available from GET /{lecture_id}.
+    """
+    # Reject malformed requests before paying for an LLM round-trip
+    n = req.num_questions
+    if n <= 0:
+        raise HTTPException(status_code=422, detail="num_questions must be positive.")
+
+    lecture = await store.get_lecture(lecture_id)
     if not lecture:
         raise HTTPException(status_code=404, detail="Lecture not found.")
+    if len(lecture.raw_text.strip()) < MIN_LECTURE_CHARS:
+        raise HTTPException(
+            status_code=422,
+            detail="Lecture text is too short to generate questions from.",
+        )
 
-    n = req.num_questions
     mcq = int(n * req.mcq_ratio)
     fill_b = int(n * req.fill_blank_ratio)
     short = n - mcq - fill_b
+    if mcq < 0 or fill_b < 0 or short < 0:
+        # Ratios that don't add up: fall back to the default 60/20/20 split
+        mcq = int(n * 0.6)
+        fill_b = int(n * 0.2)
+        short = n - mcq - fill_b
     mix = {"mcq": mcq, "fill_blank": fill_b, "short_answer": short}
 
-    questions = await generate_questions_from_text(
-        text=lecture.raw_text, num_questions=n, mix=mix
-    )
+    questions = await qgen_batcher.submit((lecture.raw_text, n, mix))
     lecture.questions = questions
-    LECTURES[lecture_id] = lecture
+    lecture.index_questions()
+    await store.put_lecture(lecture)
 
     return QuestionGenerationResponse(
         lecture_id=lecture.id,
         total_questions=len(questions),
-        questions=questions,
+        questions=questions if include_questions else None,
     )
 
 
-@router.get("", response_model=List[LectureCreateResponse])
-async def list_lectures():
-    """List all available lectures."""
-    return [
-        LectureCreateResponse(
-            lecture_id=lecture.id,
-            title=lecture.title,
-            source_type=lecture.source_type,
-        )
-        for lecture in LECTURES.values()
-    ]
-
-
 @router.get("/{lecture_id}")
 async def get_lecture(lecture_id: str):
     """Get lecture details including all questions."""
-    lecture = LECTURES.get(lecture_id)
+    lecture = await store.get_lecture(lecture_id)
     if not lecture:
         raise HTTPException(status_code=404, detail="Lecture not found.")
     return lecture
@@ -215,14 +247,14 @@ async def get_lecture(lecture_id: str):
 @router.post("/{lecture_id}/start-session", response_model=SessionStartResponse)
 async def start_session(lecture_id: str, req: SessionStartRequest):
     """Start a new adaptive test session with proctoring."""
-    lecture = LECTURES.get(lecture_id)
+    lecture = await store.get_lecture(lecture_id)
     if not lecture or not lecture.questions:
         raise HTTPException(
             status_code=400,
             detail="Lecture not found or no questions generated yet.",
         )
 
-    session_id = str(uuid.uuid4())
+    session_id = new_id()
     session = TestSession(
         id=session_id,
         lecture_id=lecture_id,
@@ -234,7 +266,7 @@ async def start_session(lecture_id: str, req: SessionStartRequest):
     if not first_q:
         raise HTTPException(status_code=400, detail="No questions available.")
 
-    SESSIONS[session_id] = session
+    await store.put_session(session)
 
     # Initialize proctoring for this session
     proctoring_engine.start_proctoring_session(session_id)
@@ -248,13 +280,16 @@ async def start_session(lecture_id: str, req: SessionStartRequest):
 
 
 @router.post("/{lecture_id}/answer", response_model=AnswerQuestionResponse)
-async def answer_question(lecture_id: str, req: AnswerQuestionRequest):
+async def answer_question(
+    lecture_id: str,
+    req: AnswerQuestionRequest,
+):
     """Submit answer and get next question with adaptive difficulty."""
-    lecture = LECTURES.get(lecture_id)
+    lecture = await store.get_lecture(lecture_id)
     if not lecture:
         raise HTTPException(status_code=404, detail="Lecture not found.")
 
-    session = SESSIONS.get(req.session_id)
+    session = await store.get_session(req.session_id)
     if not session or session.lecture_id != lecture_id:
         raise HTTPException(status_code=404, detail="Session not found for this lecture.")
 
@@ -262,7 +297,7 @@ async def answer_question(lecture_id: str, req: AnswerQuestionRequest):
 
     # ========== Evaluate correctness ==========
     is_correct = False
-    correct_answer_text: Optional[str] = question.answer
+    correct_answer_text: Optional[str] = question.canonical_correct_text
 
     if question.type == "mcq":
         if req.selected_option_index is None:
@@ -279,15 +314,10 @@ async def answer_question(lecture_id: str, req: AnswerQuestionRequest):
                 detail="selected_option_index is out of range.",
             )
         is_correct = question.options[req.selected_option_index].is_correct
-        # Get correct option text for display
-        for opt in question.options or []:
-            if opt.is_correct:
-                correct_answer_text = opt.text
-                break
     else:
         # Simple string comparison for fill_blank and short_answer
         is_correct = (
-            normalize_text(req.learner_answer) == normalize_text(question.answer)
+            normalize_text(req.learner_answer) == question._normalized_answer
         )
 
     # ========== Update session stats ==========
@@ -295,7 +325,7 @@ async def answer_question(lecture_id: str, req: AnswerQuestionRequest):
     if is_correct:
         session.correct_count += 1
 
-    session.answers.append(
+    session.record_answer(
         AnswerRecord(
             question_id=question.id,
             is_correct=is_correct,
@@ -318,14 +348,15 @@ async def answer_question(lecture_id: str, req: AnswerQuestionRequest):
 
     # ========== Handle session completion ==========
     if finished:
-        session.completed_at = datetime.now()
+        session.complete()
         
-        # Record analytics
+        # Recorded inline, on the event loop: a sync background task would run
+        # in the threadpool and race the analytics endpoints' reads
         if session.learner_id:
             analytics_engine.record_session(session, lecture)
 
     # Save session
-    SESSIONS[session.id] = session
+    await store.put_session(session)
 
     return AnswerQuestionResponse(
         correct=is_correct,
@@ -342,22 +373,45 @@ async def answer_question(lecture_id: str, req: AnswerQuestionRequest):
 # Proctoring Endpoints (New additions)
 # ============================================================================
 
+async def _append_proctoring_flags(items: List[tuple]) -> List[None]:
+    """Persist a batch of (session_id, flag) pairs, one store write per session."""
+    by_session: Dict[str, List[dict]] = defaultdict(list)
+    for session_id, flag in items:
+        by_session[session_id].append(flag)
+
+    for session_id, flags in by_session.items():
+        try:
+            await store.add_proctoring_flags(session_id, flags)
+        except Exception as e:
+            print(f"⚠️ Could not save proctoring flags for {session_id}: {e}")
+    return [None] * len(items)
+
+
+# Proctoring clients send events in bursts; coalesce the session writes
+proctoring_flag_batcher = MicroBatcher(_append_proctoring_flags, max_batch=64, max_wait_ms=100)
+
+
 @router.post("/proctoring/{session_id}/event")
-async def log_proctoring_event(session_id: str, event: ProctoringEvent):
+async def log_proctoring_event(
+    session_id: str,
+    event: ProctoringEvent,
+    background_tasks: BackgroundTasks,
+):
     """Log a proctoring event during the exam."""
-    session = SESSIONS.get(session_id)
-    if not session:
+    if not await store.sessions_store.contains(session_id):
         raise HTTPException(status_code=404, detail="Session not found.")
     
     result = proctoring_engine.log_proctoring_event(event)
+    if result.get("status") == "duplicate_ignored":
+        return result
     
-    # Add to session flags
-    session.proctoring_flags.append({
+    # Add to session flags once the response is out
+    flag = {
         "type": event.event_type,
-        "timestamp": event.timestamp.isoformat(),
+        "ts": event.timestamp.timestamp(),  # epoch seconds; format when displayed
         "confidence": event.confidence,
-    })
-    SESSIONS[session_id] = session
+    }
+    background_tasks.add_task(proctoring_flag_batcher.submit, (session_id, flag))
     
     return result
 
@@ -365,7 +419,7 @@ async def log_proctoring_event(session_id: str, event: ProctoringEvent):
 @router.get("/proctoring/{session_id}/report", response_model=ProctoringReport)
 async def get_proctoring_report(session_id: str):
     """Get comprehensive proctoring report for a session."""
-    session = SESSIONS.get(session_id)
+    session = await store.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
     
@@ -377,34 +431,32 @@ async def get_proctoring_report(session_id: str):
 # Analytics Endpoints (New additions)
 # ============================================================================
 
+def prefers_msgpack(accept: Optional[str] = Header(None)) -> bool:
+    """True when the client asks for msgpack and we can produce it."""
+    return MSGPACK_AVAILABLE and bool(accept) and "application/msgpack" in accept
+
+
+def analytics_response(analytics: BaseModel, use_msgpack: bool) -> Response:
+    # Encode directly: returning the model would have FastAPI re-validate it
+    # against response_model and walk it through jsonable_encoder first
+    if use_msgpack:
+        return Response(
+            content=msgpack.packb(analytics.model_dump()),
+            media_type="application/msgpack",
+        )
+    return ORJSONResponse(analytics.model_dump())
+
+
 @router.get("/analytics/student/{student_id}", response_model=StudentAnalytics)
-async def get_student_analytics(student_id: str):
+async def get_student_analytics(student_id: str, use_msgpack: bool = Depends(prefers_msgpack)):
     """Get comprehensive analytics for a specific student."""
-    analytics = analytics_engine.get_student_analytics(student_id)
-    
-    return StudentAnalytics(
-        student_id=analytics.student_id,
-        total_exams=analytics.total_exams,
-        average_score=analytics.average_score,
-        time_per_question=analytics.time_per_question,
-        difficulty_performance=analytics.difficulty_performance,
-        topic_performance=analytics.topic_performance,
-        improvement_trend=analytics.improvement_trend,
-        recent_sessions=[]
-    )
+    return analytics_response(analytics_engine.get_student_analytics(student_id), use_msgpack)
 
 
 @router.get("/analytics/class/overview", response_model=ClassAnalytics)
-async def get_class_analytics():
+async def get_class_analytics(use_msgpack: bool = Depends(prefers_msgpack)):
     """Get class-wide analytics and statistics."""
-    analytics = analytics_engine.get_class_analytics()
-    return ClassAnalytics(
-        total_students=analytics["total_students"],
-        total_exams=analytics["total_exams"],
-        average_score=analytics["average_score"],
-        top_performers=analytics["top_performers"],
-        common_weak_topics=analytics["common_weak_topics"],
-    )
+    return analytics_response(analytics_engine.get_class_analytics(), use_msgpack)
 
 
 # ============================================================================
@@ -414,14 +466,14 @@ async def get_class_analytics():
 @router.get("/results/{session_id}")
 async def get_session_results(session_id: str):
     """Get detailed results for a completed exam session."""
-    session = SESSIONS.get(session_id)
+    session = await store.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     if session.completed_at is None:
         raise HTTPException(status_code=400, detail="Exam not yet completed")
     
-    lecture = LECTURES.get(session.lecture_id)
+    lecture = await store.get_lecture(session.lecture_id)
     if not lecture:
         raise HTTPException(status_code=404, detail="Lecture not found")
     
@@ -429,23 +481,22 @@ async def get_session_results(session_id: str):
     score = (session.correct_count / session.total_answered * 100) if session.total_answered > 0 else 0
     
     # Build results for each question
-    results = []
-    for answer in session.answers:
-        question = get_question_by_id(lecture, answer.question_id)
-        if question:
-            results.append({
-                "question": question.prompt,
-                "your_answer": answer.learner_answer,
-                "correct_answer": question.answer,
-                "is_correct": answer.is_correct,
-                "explanation": question.explanation,
-                "difficulty": question.difficulty
-            })
+    by_id = lecture._by_id
+    results = [
+        {
+            "question": question.prompt,
+            "your_answer": answer.learner_answer,
+            "correct_answer": question.answer,
+            "is_correct": answer.is_correct,
+            "explanation": question.explanation,
+            "difficulty": question.difficulty
+        }
+        for answer in session.answers
+        if (question := by_id.get(answer.question_id)) is not None
+    ]
     
     # Get proctoring data using ProctoringEngine
     try:
-        from app.services.proctoring import proctoring_engine
-        
         proctoring_report = proctoring_engine.get_proctoring_report(session_id)
         
         if "error" not in proctoring_report:
@@ -457,21 +508,11 @@ async def get_session_results(session_id: str):
             }
         else:
             # Fallback if session not found in proctoring engine
-            proctoring_data = {
-                "integrity_score": 100,
-                "risk_level": "low",
-                "total_events": 0,
-                "recommendations": ["✓ No proctoring data available"]
-            }
+            proctoring_data = _NO_PROCTORING
     except Exception as e:
         print(f"Error loading proctoring data: {e}")
         # Fallback if proctoring not available
-        proctoring_data = {
-            "integrity_score": 100,
-            "risk_level": "low",
-            "total_events": 0,
-            "recommendations": ["Proctoring data unavailable"]
-        }
+        proctoring_data = _UNAVAILABLE_PROCTORING
     
     return {
         "score": score,
@@ -479,7 +520,7 @@ async def get_session_results(session_id: str):
         "total": session.total_answered,
         "lecture_title": lecture.title,
         "learner_id": session.learner_id,
-        "completed_at": session.completed_at.isoformat() if session.completed_at else None,
+        "completed_at": session.completed_iso,
         "results": results,
         "proctoring": proctoring_data
     }
@@ -487,11 +528,11 @@ async def get_session_results(session_id: str):
 @router.get("/session/{session_id}")
 async def get_session_info(session_id: str):
     """Get current session information and progress."""
-    session = SESSIONS.get(session_id)
+    session = await store.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
     
-    lecture = LECTURES.get(session.lecture_id)
+    lecture = await store.get_lecture(session.lecture_id)
     
     return {
         "session_id": session.id,
@@ -502,251 +543,5 @@ async def get_session_info(session_id: str):
         "progress": f"{session.total_answered}/{len(lecture.questions) if lecture else 0}",
         "score": (session.correct_count / session.total_answered) if session.total_answered else 0,
         "started_at": session.started_at.isoformat() if session.started_at else None,
-        "completed_at": session.completed_at.isoformat() if session.completed_at else None,
+        "completed_at": session.completed_iso,
     }
-    
-@router.get("/analytics/student/{student_id}")
-async def get_student_analytics(student_id: str):
-    """Get analytics for a specific student."""
-    # Find all sessions for this student
-    student_sessions = [
-        session for session in SESSIONS.values()
-        if session.learner_id == student_id and session.completed_at is not None
-    ]
-    
-    if not student_sessions:
-        return {
-            "total_exams": 0,
-            "average_score": 0,
-            "time_per_question": 0,
-            "difficulty_performance": {"easy": 0, "medium": 0, "hard": 0},
-            "topic_performance": {},
-            "improvement_trend": []
-        }
-    
-    # Calculate metrics
-    total_exams = len(student_sessions)
-    total_correct = sum(s.correct_count for s in student_sessions)
-    total_answered = sum(s.total_answered for s in student_sessions)
-    average_score = (total_correct / total_answered * 100) if total_answered > 0 else 0
-    
-    # Difficulty performance
-    difficulty_stats = defaultdict(lambda: {"correct": 0, "total": 0})
-    topic_stats = defaultdict(lambda: {"correct": 0, "total": 0})
-    
-    for session in student_sessions:
-        for answer in session.answers:
-            # Track by difficulty
-            if answer.difficulty:
-                difficulty_stats[answer.difficulty]["total"] += 1
-                if answer.is_correct:
-                    difficulty_stats[answer.difficulty]["correct"] += 1
-            
-            # Track by topic (get from question)
-            lecture = LECTURES.get(session.lecture_id)
-            if lecture:
-                question = get_question_by_id(lecture, answer.question_id)
-                if question and question.topic:
-                    topic_stats[question.topic]["total"] += 1
-                    if answer.is_correct:
-                        topic_stats[question.topic]["correct"] += 1
-    
-    # Calculate percentages
-    difficulty_performance = {
-        diff: (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
-        for diff, stats in difficulty_stats.items()
-    }
-    
-    topic_performance = {
-        topic: (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
-        for topic, stats in topic_stats.items()
-    }
-    
-    # Improvement trend (scores over time)
-    improvement_trend = [
-        round(s.correct_count / s.total_answered * 100) if s.total_answered > 0 else 0
-        for s in sorted(student_sessions, key=lambda x: x.completed_at)
-    ]
-    
-    return {
-        "total_exams": total_exams,
-        "average_score": round(average_score, 1),
-        "time_per_question": 30,  # You can track this if you add timing to answers
-        "difficulty_performance": difficulty_performance,
-        "topic_performance": topic_performance,
-        "improvement_trend": improvement_trend
-    }
-
-
-@router.get("/analytics/class/overview")
-async def get_class_analytics():
-    """Get overall class analytics."""
-    # Find all completed sessions
-    completed_sessions = [
-        session for session in SESSIONS.values()
-        if session.completed_at is not None
-    ]
-    
-    if not completed_sessions:
-        return {
-            "total_students": 0,
-            "total_exams": 0,
-            "average_score": 0
-        }
-    
-    # Get unique students
-    unique_students = set(s.learner_id for s in completed_sessions)
-    
-    # Calculate average score
-    total_correct = sum(s.correct_count for s in completed_sessions)
-    total_answered = sum(s.total_answered for s in completed_sessions)
-    average_score = (total_correct / total_answered * 100) if total_answered > 0 else 0
-    
-    return {
-        "total_students": len(unique_students),
-        "total_exams": len(completed_sessions),
-        "average_score": round(average_score, 1)
-    }
-
-@router.post("/proctoring/{session_id}/event")
-async def log_proctoring_event_endpoint(session_id: str, event: ProctoringEvent):
-    """Log a proctoring event for an exam session."""
-    from app.services.proctoring import proctoring_engine
-    
-    # Ensure session exists
-    if session_id not in SESSIONS:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Initialize proctoring if not already started
-    if session_id not in proctoring_engine.sessions:
-        proctoring_engine.start_proctoring_session(session_id)
-    
-    # Log the event
-    result = proctoring_engine.log_proctoring_event(event)
-    
-    return {
-        "status": "logged",
-        "event_type": event.event_type,
-        "risk_level": result.get("current_risk_level", "low")
-    }
-
-
-@router.get("/proctoring/{session_id}/report")
-async def get_proctoring_report_endpoint(session_id: str):
-    """Get proctoring report for a session."""
-    from app.services.proctoring import proctoring_engine
-    
-    report = proctoring_engine.get_proctoring_report(session_id)
-    
-    if "error" in report:
-        raise HTTPException(status_code=404, detail=report["error"])
-    
-    return report
-
-@router.get("/analytics/student/{student_id}")
-async def get_student_analytics(student_id: str):
-    """Get analytics for a specific student."""
-    # Find all sessions for this student
-    student_sessions = [
-        session for session in SESSIONS.values()
-        if session.learner_id == student_id and session.completed_at is not None
-    ]
-    
-    if not student_sessions:
-        return {
-            "total_exams": 0,
-            "average_score": 0,
-            "time_per_question": 0,
-            "difficulty_performance": {"easy": 0, "medium": 0, "hard": 0},
-            "topic_performance": {},
-            "improvement_trend": []
-        }
-    
-    # Calculate metrics
-    total_exams = len(student_sessions)
-    total_correct = sum(s.correct_count for s in student_sessions)
-    total_answered = sum(s.total_answered for s in student_sessions)
-    average_score = (total_correct / total_answered * 100) if total_answered > 0 else 0
-    
-    # Difficulty performance
-    difficulty_stats = defaultdict(lambda: {"correct": 0, "total": 0})
-    topic_stats = defaultdict(lambda: {"correct": 0, "total": 0})
-    
-    for session in student_sessions:
-        lecture = LECTURES.get(session.lecture_id)
-        if not lecture:
-            continue
-            
-        for answer in session.answers:
-            # Track by difficulty
-            if answer.difficulty:
-                difficulty_stats[answer.difficulty]["total"] += 1
-                if answer.is_correct:
-                    difficulty_stats[answer.difficulty]["correct"] += 1
-            
-            # Track by topic (get from question)
-            question = get_question_by_id(lecture, answer.question_id)
-            if question and question.topic:
-                topic_stats[question.topic]["total"] += 1
-                if answer.is_correct:
-                    topic_stats[question.topic]["correct"] += 1
-    
-    # Calculate percentages
-    difficulty_performance = {}
-    for diff in ["easy", "medium", "hard"]:
-        if diff in difficulty_stats:
-            stats = difficulty_stats[diff]
-            difficulty_performance[diff] = (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
-        else:
-            difficulty_performance[diff] = 0
-    
-    topic_performance = {
-        topic: (stats["correct"] / stats["total"] * 100) if stats["total"] > 0 else 0
-        for topic, stats in topic_stats.items()
-    }
-    
-    # Improvement trend (scores over time)
-    improvement_trend = [
-        round(s.correct_count / s.total_answered * 100) if s.total_answered > 0 else 0
-        for s in sorted(student_sessions, key=lambda x: x.completed_at or datetime.min)
-    ]
-    
-    return {
-        "total_exams": total_exams,
-        "average_score": round(average_score, 1),
-        "time_per_question": 30,  # Default value
-        "difficulty_performance": difficulty_performance,
-        "topic_performance": topic_performance,
-        "improvement_trend": improvement_trend
-    }
-
-
-@router.get("/analytics/class/overview")
-async def get_class_analytics():
-    """Get overall class analytics."""
-    # Find all completed sessions
-    completed_sessions = [
-        session for session in SESSIONS.values()
-        if session.completed_at is not None
-    ]
-    
-    if not completed_sessions:
-        return {
-            "total_students": 0,
-            "total_exams": 0,
-            "average_score": 0
-        }
-    
-    # Get unique students
-    unique_students = set(s.learner_id for s in completed_sessions)
-    
-    # Calculate average score
-    total_correct = sum(s.correct_count for s in completed_sessions)
-    total_answered = sum(s.total_answered for s in completed_sessions)
-    average_score = (total_correct / total_answered * 100) if total_answered > 0 else 0
-    
-    return {
-        "total_students": len(unique_students),
-        "total_exams": len(completed_sessions),
-        "average_score": round(average_score, 1)
-    }
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Admission control for calls to slow external backends (LLM, transcription).
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import HTTPException
+
+
+class AdmissionGate:
+    """
+    Cap concurrent calls to a backend and shed load instead of queueing forever.
+
+    At most `limit` callers hold a slot at once. A caller that cannot get a
+    slot within `queue_timeout` seconds gets a 503 with a Retry-After header,
+    so the client backs off rather than holding a connection open.
+    """
+
+    def __init__(self, name: str, limit: int, queue_timeout: float):
+        self.name = name
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        # asyncio.timeout cancels this task rather than a wrapped acquire()
+        # as wait_for does, so a slot granted as the timer fires is never
+        # orphaned: either we hold it (and release below) or we don't.
+        acquired = False
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await self._slots.acquire()
+                acquired = True
+        except TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail=f"{self.name} is busy, please retry shortly.",
+                headers={"Retry-After": str(max(1, round(self.queue_timeout)))},
+            )
+        except BaseException:
+            # Cancelled (e.g. the client went away) after getting the slot
+            if acquired:
+                self._slots.release()
+            raise
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 4))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", 15))
+TRANSCRIBE_CONCURRENCY = int(os.environ.get("TRANSCRIBE_CONCURRENCY", 4))
+TRANSCRIBE_QUEUE_TIMEOUT = float(os.environ.get("TRANSCRIBE_QUEUE_TIMEOUT_SECONDS", 30))
+
+# Global gates shared by every route that reaches the backend
+llm_gate = AdmissionGate("Question generation", LLM_CONCURRENCY, LLM_QUEUE_TIMEOUT)
+transcription_gate = AdmissionGate("Transcription", TRANSCRIBE_CONCURRENCY, TRANSCRIBE_QUEUE_TIMEOUT)
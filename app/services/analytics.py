@@ -1,30 +1,89 @@
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
-from collections import defaultdict
-import json
-
-class AnalyticsData:
-    """Simple analytics data container."""
-    def __init__(self, student_id: str, total_exams: int, average_score: float, 
-                 time_per_question: float, difficulty_performance: Dict, 
-                 topic_performance: Dict, improvement_trend: List):
-        self.student_id = student_id
-        self.total_exams = total_exams
-        self.average_score = average_score
-        self.time_per_question = time_per_question
-        self.difficulty_performance = difficulty_performance
-        self.topic_performance = topic_performance
-        self.improvement_trend = improvement_trend
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from datetime import datetime
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass, field
+import heapq
+import time
+from operator import itemgetter
+
+import numpy as np
+
+from app.models import DIFFICULTY_LEVELS, ClassAnalytics, StudentAnalytics
+
+# Aggregates only change when a session is recorded. Per-student results are
+# keyed by the student's recorded-session count; the class overview is
+# dropped on every record, and its TTL just bounds how long it can linger.
+CLASS_ANALYTICS_TTL = 10
+MAX_CACHED_STUDENTS = 10_000
+
+_MEDIUM = DIFFICULTY_LEVELS.index("medium")
+
+
+@dataclass(slots=True)
+class SessionAggregate:
+    """Per-session answer counts, computed once when the session is recorded."""
+    diff_total: np.ndarray    # answers per DIFFICULTY_LEVELS entry
+    diff_correct: np.ndarray  # correct answers per DIFFICULTY_LEVELS entry
+    topic_total: Dict[str, int]
+    topic_correct: Dict[str, int]
+
+    @classmethod
+    def from_session(cls, session, lecture) -> "SessionAggregate":
+        # Answers record their question's difficulty; unknown counts as medium
+        columns = session._columns
+        difficulty = np.where(columns.difficulty < 0, _MEDIUM, columns.difficulty)
+        n_levels = len(DIFFICULTY_LEVELS)
+
+        # Topics need the question itself
+        topic_total: Dict[str, int] = defaultdict(int)
+        topic_correct: Dict[str, int] = defaultdict(int)
+        by_id = lecture._by_id
+        for answer in session.answers:
+            question = by_id.get(answer.question_id)
+            if question and question.topic:
+                topic_total[question.topic] += 1
+                topic_correct[question.topic] += answer.is_correct
+
+        return cls(
+            diff_total=np.bincount(difficulty, minlength=n_levels),
+            diff_correct=np.bincount(difficulty[columns.is_correct], minlength=n_levels),
+            topic_total=dict(topic_total),
+            topic_correct=dict(topic_correct),
+        )
+
+
+def _difficulty_counts() -> np.ndarray:
+    return np.zeros(len(DIFFICULTY_LEVELS), dtype=np.int64)
+
+
+@dataclass(slots=True)
+class StudentRecord:
+    """Running totals for one student, updated once per recorded session."""
+    sessions: List[Dict[str, Any]] = field(default_factory=list)
+    score_sum: float = 0.0
+    score_count: int = 0
+    recent_scores: Deque[float] = field(default_factory=lambda: deque(maxlen=10))  # improvement trend
+    time_sum: float = 0.0
+    time_count: int = 0
+    diff_total: np.ndarray = field(default_factory=_difficulty_counts)
+    diff_correct: np.ndarray = field(default_factory=_difficulty_counts)
+    topic_total: Counter = field(default_factory=Counter)
+    topic_correct: Counter = field(default_factory=Counter)
+
 
 class AnalyticsEngine:
     def __init__(self):
-        self.student_data = defaultdict(lambda: {
-            "sessions": [],
-            "scores": [],
-            "time_data": [],
-            "difficulty_performance": {"easy": [], "medium": [], "hard": []},
-            "topic_performance": defaultdict(list)
-        })
+        self.student_data: Dict[str, StudentRecord] = defaultdict(StudentRecord)
+        self._total_sessions = 0
+        # student_id -> sessions recorded so far; caches hold (version, result)
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._student_cache: Dict[str, Tuple[int, StudentAnalytics]] = {}
+        self._recommendations_cache: Dict[str, Tuple[int, List[str]]] = {}
+        # Class-wide topic counts, so the overview needn't merge every student's
+        self._class_topic_total: Counter = Counter()
+        self._class_topic_correct: Counter = Counter()
+        # (expires_at, overview)
+        self._class_cache: Optional[Tuple[float, ClassAnalytics]] = None
     
     def record_session(self, session, lecture):
         """Record a completed exam session for analytics."""
@@ -34,129 +93,178 @@ class AnalyticsEngine:
         
         score_percentage = (session.correct_count / session.total_answered * 100) if session.total_answered else 0
         
-        self.student_data[student_id]["sessions"].append({
+        completed_at = session.completed_at
+        if completed_at is None:
+            completed_at = datetime.now()  # recorded before being marked complete
+
+        data = self.student_data[student_id]
+        data.sessions.append({
             "session_id": session.id,
-            "date": session.completed_at or datetime.now(),
+            "date": completed_at,
             "score": score_percentage,
             "lecture_id": session.lecture_id
         })
         
-        self.student_data[student_id]["scores"].append(score_percentage)
+        data.recent_scores.append(score_percentage)
+        data.score_sum += score_percentage
+        data.score_count += 1
         
-        # Record time and performance data by difficulty and topic
-        for answer in session.answers:
-            # Find the question to get difficulty and topic
-            question = next((q for q in lecture.questions if q.id == answer.question_id), None)
-            if question:
-                difficulty = answer.difficulty or question.difficulty or "medium"
-                if difficulty in self.student_data[student_id]["difficulty_performance"]:
-                    self.student_data[student_id]["difficulty_performance"][difficulty].append(
-                        1.0 if answer.is_correct else 0.0
-                    )
-                
-                if question.topic:
-                    self.student_data[student_id]["topic_performance"][question.topic].append(
-                        1.0 if answer.is_correct else 0.0
-                    )
-            
-            # Record time data
-            if answer.time_spent:
-                self.student_data[student_id]["time_data"].append(answer.time_spent)
+        time_spent = session._columns.time_spent
+        reported = time_spent[time_spent > 0]
+        data.time_sum += float(reported.sum(dtype=np.float64))
+        data.time_count += len(reported)
+
+        agg = SessionAggregate.from_session(session, lecture)
+        data.diff_total += agg.diff_total
+        data.diff_correct += agg.diff_correct
+        data.topic_total.update(agg.topic_total)
+        data.topic_correct.update(agg.topic_correct)
+        self._class_topic_total.update(agg.topic_total)
+        self._class_topic_correct.update(agg.topic_correct)
+        self._total_sessions += 1
+        
+        # Invalidate last, so nothing can cache the old totals under the new version
+        self._versions[student_id] += 1
+        self._class_cache = None
+    
+    def get_student_analytics(self, student_id: str) -> StudentAnalytics:
+        """Analytics for a student, cached until their next recorded session."""
+        return self._cached(self._student_cache, student_id, self._compute_student_analytics)
     
-    def get_student_analytics(self, student_id: str):
+    def _cached(self, cache: Dict, student_id: str, compute):
+        version = self._versions.get(student_id, 0)
+        cached = cache.get(student_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        result = compute(student_id)
+        if len(cache) >= MAX_CACHED_STUDENTS:
+            cache.clear()
+        cache[student_id] = (version, result)
+        return result
+    
+    def _compute_student_analytics(self, student_id: str) -> StudentAnalytics:
         """Generate comprehensive analytics for a student."""
         data = self.student_data.get(student_id)
         
-        if not data or not data["scores"]:
-            return AnalyticsData(
+        if not data or not data.score_count:
+            return StudentAnalytics.model_construct(
                 student_id=student_id,
                 total_exams=0,
                 average_score=0.0,
                 time_per_question=0.0,
                 difficulty_performance={},
                 topic_performance={},
-                improvement_trend=[]
+                improvement_trend=[],
+                recent_sessions=[]
             )
         
         # Calculate metrics
-        total_exams = len(data["sessions"])
-        average_score = sum(data["scores"]) / len(data["scores"]) if data["scores"] else 0.0
+        total_exams = len(data.sessions)
+        average_score = data.score_sum / data.score_count
         
         # Time per question
-        avg_time = sum(data["time_data"]) / len(data["time_data"]) if data["time_data"] else 45.0
+        avg_time = data.time_sum / data.time_count if data.time_count else 45.0
         
         # Difficulty performance
-        difficulty_performance = {}
-        for difficulty, scores in data["difficulty_performance"].items():
-            if scores:
-                difficulty_performance[difficulty] = sum(scores) / len(scores) * 100
+        diff_total = data.diff_total
+        diff_correct = data.diff_correct
+        difficulty_performance = {
+            level: float(diff_correct[i] / diff_total[i] * 100)
+            for i, level in enumerate(DIFFICULTY_LEVELS)
+            if diff_total[i]
+        }
         
         # Topic performance
-        topic_performance = {}
-        for topic, scores in data["topic_performance"].items():
-            if scores:
-                topic_performance[topic] = sum(scores) / len(scores) * 100
+        topic_total, topic_correct = data.topic_total, data.topic_correct
+        topic_performance = {
+            topic: topic_correct[topic] / total * 100
+            for topic, total in topic_total.items()
+        }
         
         # Improvement trend (last 10 sessions)
-        improvement_trend = data["scores"][-10:] if len(data["scores"]) >= 10 else data["scores"]
+        improvement_trend = list(data.recent_scores)
         
-        return AnalyticsData(
+        # Field types are guaranteed by the arithmetic above; skip validation
+        return StudentAnalytics.model_construct(
             student_id=student_id,
             total_exams=total_exams,
             average_score=round(average_score, 2),
             time_per_question=round(avg_time, 1),
             difficulty_performance=difficulty_performance,
             topic_performance=topic_performance,
-            improvement_trend=improvement_trend
+            improvement_trend=improvement_trend,
+            recent_sessions=[]
         )
     
-    def get_class_analytics(self) -> Dict:
+    def get_class_analytics(self) -> ClassAnalytics:
+        """Class overview, served from cache while fresh."""
+        now = time.monotonic()
+        if self._class_cache is not None and self._class_cache[0] > now:
+            return self._class_cache[1]
+
+        analytics = self._compute_class_analytics()
+        self._class_cache = (now + CLASS_ANALYTICS_TTL, analytics)
+        return analytics
+    
+    def _compute_class_analytics(self) -> ClassAnalytics:
         """Get analytics for all students (class overview)."""
         if not self.student_data:
-            return {
-                "total_students": 0,
-                "total_exams": 0,
-                "average_score": 0.0,
-                "top_performers": [],
-                "common_weak_topics": []
-            }
-        
-        all_scores = []
-        all_topics = defaultdict(list)
-        student_averages = []
-        
-        for student_id, data in self.student_data.items():
-            if data["scores"]:
-                avg = sum(data["scores"]) / len(data["scores"])
-                student_averages.append({"student_id": student_id, "average": avg})
-                all_scores.extend(data["scores"])
-                
-                for topic, scores in data["topic_performance"].items():
-                    all_topics[topic].extend(scores)
-        
-        # Top performers
-        student_averages.sort(key=lambda x: x["average"], reverse=True)
-        top_performers = student_averages[:5]
+            return ClassAnalytics.model_construct(
+                total_students=0,
+                total_exams=0,
+                average_score=0.0,
+                top_performers=[],
+                common_weak_topics=[]
+            )
+        
+        # Per-student score sums/counts as arrays
+        graded = [(sid, data) for sid, data in self.student_data.items() if data.score_count]
+        student_ids = [sid for sid, _ in graded]
+        score_sums = np.fromiter((data.score_sum for _, data in graded), dtype=np.float64, count=len(graded))
+        score_counts = np.fromiter((data.score_count for _, data in graded), dtype=np.int64, count=len(graded))
+        score_count = int(score_counts.sum())
+        
+        # Top performers: partition out the best 5, then order just those
+        top_performers = []
+        if graded:
+            averages = score_sums / score_counts
+            k = min(5, len(graded))
+            top = np.argpartition(-averages, k - 1)[:k]
+            top = top[np.lexsort((top, -averages[top]))]
+            top_performers = [
+                {"student_id": student_ids[i], "average": float(averages[i])} for i in top
+            ]
         
         # Weak topics
-        weak_topics = []
-        for topic, scores in all_topics.items():
-            if scores:
-                avg_performance = sum(scores) / len(scores) * 100
-                if avg_performance < 60:
-                    weak_topics.append({"topic": topic, "performance": round(avg_performance, 2)})
-        
-        weak_topics.sort(key=lambda x: x["performance"])
-        
-        return {
-            "total_students": len(self.student_data),
-            "total_exams": sum(len(data["sessions"]) for data in self.student_data.values()),
-            "average_score": round(sum(all_scores) / len(all_scores), 2) if all_scores else 0.0,
-            "top_performers": top_performers[:5],
-            "common_weak_topics": weak_topics[:5]
-        }
+        topics = list(self._class_topic_total)
+        topic_total = np.fromiter(self._class_topic_total.values(), dtype=np.int64, count=len(topics))
+        topic_correct = np.fromiter(
+            (self._class_topic_correct[t] for t in topics), dtype=np.int64, count=len(topics)
+        )
+        performance = topic_correct / np.maximum(topic_total, 1) * 100
+        weak = np.flatnonzero((topic_total > 0) & (performance < 60))
+        weak_topics = heapq.nsmallest(
+            5,
+            ({"topic": topics[i], "performance": round(float(performance[i]), 2)} for i in weak),
+            key=itemgetter("performance"),
+        )
+        
+        return ClassAnalytics.model_construct(
+            total_students=len(self.student_data),
+            total_exams=self._total_sessions,
+            average_score=round(float(score_sums.sum()) / score_count, 2) if score_count else 0.0,
+            top_performers=top_performers[:5],
+            common_weak_topics=weak_topics[:5]
+        )
     
     def generate_recommendations(self, student_id: str) -> List[str]:
+        """Recommendations for a student, cached like their analytics."""
+        return self._cached(
+            self._recommendations_cache, student_id, self._compute_recommendations
+        )
+    
+    def _compute_recommendations(self, student_id: str) -> List[str]:
         """Generate personalized recommendations based on analytics."""
         analytics = self.get_student_analytics(student_id)
         recommendations = []
@@ -0,0 +1,132 @@
+"""
+Micro-batching helper: coalesce concurrent calls into one backend request.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.models import new_id
+
+
+class MicroBatcher:
+    """
+    Collect items submitted concurrently and hand them to `handler` in batches.
+
+    A batch is flushed when `max_batch` items are waiting or `max_wait_ms`
+    has elapsed since the first item of the batch arrived. `handler` receives
+    the list of items and must return one result per item, in order; a result
+    that is an exception instance is raised to that item's caller only.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: int = 16,
+        max_wait_ms: float = 50,
+    ):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        """Start the background worker on the running event loop."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the worker; batches already dispatched are left to finish."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result."""
+        if self._worker is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch without awaiting so the next batch can accumulate meanwhile
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def _question_request_key(text: str, num_questions: int, mix: Optional[Dict[str, int]]) -> tuple:
+    return text, num_questions, tuple(sorted((mix or {}).items()))
+
+
+def question_batch_handler(
+    generate: Callable[[str, int, Optional[Dict[str, int]]], Awaitable[List[Any]]],
+) -> Callable[[List[tuple]], Awaitable[List[Any]]]:
+    """
+    MicroBatcher handler for (text, num_questions, mix) generation requests.
+
+    Identical requests in a batch share one `generate` call; the rest run
+    concurrently. Failures are returned per request rather than raised.
+    """
+    async def handle(requests: List[tuple]) -> List[Any]:
+        unique: Dict[tuple, tuple] = {}
+        for request in requests:
+            unique.setdefault(_question_request_key(*request), request)
+
+        keys = list(unique)
+        results = await asyncio.gather(
+            *(generate(*unique[k]) for k in keys),
+            return_exceptions=True,
+        )
+        by_key = dict(zip(keys, results))
+
+        out: List[Any] = []
+        seen: Set[tuple] = set()
+        for request in requests:
+            key = _question_request_key(*request)
+            result = by_key[key]
+            if key in seen and not isinstance(result, BaseException):
+                # Duplicates get their own question ids
+                result = [q.model_copy(update={"id": new_id()}) for q in result]
+            seen.add(key)
+            out.append(result)
+        return out
+
+    return handle
@@ -0,0 +1,166 @@
+"""
+Exact + semantic cache for LLM-generated exam questions.
+
+Exact hits are keyed by a hash of the (trimmed) lecture text, question count
+and type mix. With the Redis store configured, exact entries are also written
+to Redis so every worker shares them; with QUESTION_CACHE_DIR set they are
+also kept as JSON files there, so they survive restarts. When
+sentence-transformers is installed, near-duplicate lecture texts with the
+same count/mix are also served from the (process-local) embedding index.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from app.models import QUESTION_LIST, new_id
+from app.services.store import redis_client
+
+# Optional: sentence embeddings for near-duplicate reuse
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    EMBEDDINGS_AVAILABLE = True
+except ImportError:
+    EMBEDDINGS_AVAILABLE = False
+
+EMBEDDING_MODEL = os.environ.get("CACHE_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+MAX_TEXT_CHARS = 8000
+CACHE_TTL = int(os.environ.get("QUESTION_CACHE_TTL_SECONDS", 24 * 3600))
+CACHE_DIR = os.environ.get("QUESTION_CACHE_DIR")
+
+@dataclass(slots=True)
+class _CacheEntry:
+    key: str
+    params: Tuple[int, Tuple[Tuple[str, int], ...]]
+    questions: List[Any]
+    embedding: Optional[Any] = None
+
+
+class QuestionCache:
+    """LRU cache of generated question lists."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        similarity_threshold: float = 0.97,
+        client=None,
+        cache_dir: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.client = client
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._model = None
+
+    @staticmethod
+    def _params(num_questions: int, mix: Dict[str, int]) -> Tuple[int, Tuple[Tuple[str, int], ...]]:
+        return num_questions, tuple(sorted(mix.items()))
+
+    @staticmethod
+    def _key(text: str, params) -> str:
+        payload = text[:MAX_TEXT_CHARS] + "\0" + json.dumps(params)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _read_file(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                if time.time() - os.fstat(f.fileno()).st_mtime > CACHE_TTL:
+                    return None
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_file(self, key: str, payload: bytes) -> None:
+        # Write to a temp file and rename, so readers never see a partial entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _fresh(raw: bytes) -> List[Any]:
+        return [q.model_copy(update={"id": new_id()}) for q in QUESTION_LIST.validate_json(raw)]
+
+    async def _embed(self, text: str):
+        if self._model is None:
+            self._model = await asyncio.to_thread(SentenceTransformer, EMBEDDING_MODEL)
+        return await asyncio.to_thread(
+            self._model.encode, text[:MAX_TEXT_CHARS], normalize_embeddings=True
+        )
+
+    async def _nearest(self, text: str, params) -> Optional[_CacheEntry]:
+        candidates = [
+            e for e in self._entries.values()
+            if e.params == params and e.embedding is not None
+        ]
+        if not candidates:
+            return None
+
+        query = await self._embed(text)
+        sims = np.stack([e.embedding for e in candidates]) @ query
+        best = int(np.argmax(sims))
+        if sims[best] >= self.similarity_threshold:
+            return candidates[best]
+        return None
+
+    async def get(self, text: str, num_questions: int, mix: Dict[str, int]) -> Optional[List[Any]]:
+        """Return a fresh copy of cached questions, or None on a miss."""
+        params = self._params(num_questions, mix)
+        key = self._key(text, params)
+        entry = self._entries.get(key)
+        if entry is None and self.client is not None:
+            raw = await self.client.get("qcache:" + key)
+            if raw is not None:
+                return self._fresh(raw)
+        if entry is None and self.cache_dir is not None:
+            raw = await asyncio.to_thread(self._read_file, key)
+            if raw is not None:
+                return self._fresh(raw)
+        if entry is None and EMBEDDINGS_AVAILABLE:
+            entry = await self._nearest(text, params)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(entry.key)
+        # New ids so two lectures never share question objects
+        return [q.model_copy(update={"id": new_id()}) for q in entry.questions]
+
+    async def put(self, text: str, num_questions: int, mix: Dict[str, int], questions: List[Any]) -> None:
+        """Store generated questions, evicting the least recently used entry."""
+        params = self._params(num_questions, mix)
+        key = self._key(text, params)
+        embedding = await self._embed(text) if EMBEDDINGS_AVAILABLE else None
+
+        self._entries[key] = _CacheEntry(key, params, list(questions), embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        if self.client is None and self.cache_dir is None:
+            return
+        payload = orjson.dumps([q.model_dump() for q in questions])
+        if self.client is not None:
+            await self.client.setex("qcache:" + key, CACHE_TTL, payload)
+        if self.cache_dir is not None:
+            await asyncio.to_thread(self._write_file, key, payload)
+
+
+# Global question cache instance
+question_cache = QuestionCache(client=redis_client, cache_dir=CACHE_DIR)
@@ -3,22 +3,62 @@ Audio and Video processing service for lecture transcription
 Supports: MP3, WAV, M4A, WebM (audio) and MP4, AVI, MOV, WebM (video)
 """
 
+import asyncio
 import os
+import struct
 import tempfile
 from typing import Optional
 from fastapi import UploadFile, HTTPException
-import subprocess
 import shutil
 
+# Supported upload extensions (tuples, so str.endswith can take them whole)
+VIDEO_FORMATS = ('.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv')
+AUDIO_FORMATS = ('.mp3', '.wav', '.m4a', '.webm', '.ogg', '.flac')
+
+# Uploads are copied to disk in chunks of this size
+SPOOL_CHUNK = 1 << 20
+
+# Optional: spool uploaded videos to tmpfs (RAM) instead of the temp disk.
+# tmpfs pages count against the container's memory, so this is opt-in.
+USE_TMPFS = os.environ.get("USE_TMPFS", "0") == "1"
+TMPFS_DIR = "/dev/shm"
+
+
+def _spool_dir(size: Optional[int]) -> Optional[str]:
+    """/dev/shm when enabled and it has room for the upload, else the default temp dir."""
+    if not USE_TMPFS or not size or not os.path.isdir(TMPFS_DIR):
+        return None
+    # Leave headroom for other uploads being spooled at the same time
+    if shutil.disk_usage(TMPFS_DIR).free < 2 * size:
+        return None
+    return TMPFS_DIR
+
 # Check if ffmpeg is available (required for video processing)
 def check_ffmpeg():
     return shutil.which('ffmpeg') is not None
 
+def _fix_wav_sizes(wav: bytes) -> bytes:
+    """Fill in the RIFF/data sizes ffmpeg leaves unset when writing to a pipe."""
+    if wav[:4] != b'RIFF' or wav[8:12] != b'WAVE':
+        return wav
+    pos = 12
+    while pos + 8 <= len(wav):
+        chunk_id = wav[pos:pos + 4]
+        if chunk_id == b'data':
+            header = bytearray(wav[:pos + 8])
+            struct.pack_into('<I', header, 4, len(wav) - 8)
+            struct.pack_into('<I', header, pos + 4, len(wav) - pos - 8)
+            return b''.join((header, memoryview(wav)[pos + 8:]))
+        size, = struct.unpack_from('<I', wav, pos + 4)
+        pos += 8 + size + (size & 1)
+    return wav
+
+
 # Extract audio from video file
-async def extract_audio_from_video(video_file: UploadFile) -> str:
+async def extract_audio_from_video(video_file: UploadFile) -> bytes:
     """
     Extract audio from video file using ffmpeg
-    Returns path to extracted audio file
+    Returns the audio as 16 kHz mono WAV bytes
     """
     if not check_ffmpeg():
         raise HTTPException(
@@ -26,48 +66,57 @@ async def extract_audio_from_video(video_file: UploadFile) -> str:
             detail="ffmpeg not installed. Install with: apt-get install ffmpeg (Linux) or brew install ffmpeg (Mac)"
         )
     
-    # Create temporary files
-    video_temp = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(video_file.filename)[1])
-    audio_temp = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
+    # The video still goes through a temp file: MP4/MOV often keep their index
+    # at the end, which ffmpeg can only reach on a seekable input. The audio
+    # comes back over stdout and never touches disk.
+    video_temp = tempfile.NamedTemporaryFile(
+        delete=False,
+        suffix=os.path.splitext(video_file.filename)[1],
+        dir=_spool_dir(video_file.size)
+    )
     
     try:
-        # Save uploaded video
-        content = await video_file.read()
-        video_temp.write(content)
+        # Save uploaded video in chunks, off the event loop
+        await video_file.seek(0)
+        await asyncio.to_thread(shutil.copyfileobj, video_file.file, video_temp, SPOOL_CHUNK)
         video_temp.close()
         
         # Extract audio using ffmpeg
         command = [
             'ffmpeg',
+            '-nostdin',  # never wait on the server's stdin
+            '-loglevel', 'error',  # keep stderr to actual errors
+            '-threads', '0',  # let ffmpeg pick the thread count
             '-i', video_temp.name,
             '-vn',  # no video
+            '-sn', '-dn',  # skip subtitle / data streams
             '-acodec', 'pcm_s16le',  # audio codec
             '-ar', '16000',  # sample rate
             '-ac', '1',  # mono channel
-            audio_temp.name,
-            '-y'  # overwrite output file
+            '-f', 'wav',
+            'pipe:1'
         ]
         
-        result = subprocess.run(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
         )
+        audio_bytes, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to extract audio from video: {stderr.decode(errors='replace')}"
+            )
         
-        audio_temp.close()
-        return audio_temp.name
+        return _fix_wav_sizes(audio_bytes)
         
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to extract audio from video: {e.stderr.decode()}"
-        )
     finally:
         # Cleanup video file
+        video_temp.close()
         try:
             os.unlink(video_temp.name)
-        except:
+        except FileNotFoundError:
             pass
 
 
@@ -80,26 +129,19 @@ async def process_media_file(file: UploadFile) -> tuple[bytes, str]:
     filename = file.filename.lower()
     
     # Video formats - extract audio first
-    video_formats = ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv']
-    if any(filename.endswith(fmt) for fmt in video_formats):
-        audio_path = await extract_audio_from_video(file)
-        try:
-            with open(audio_path, 'rb') as f:
-                audio_bytes = f.read()
-            return audio_bytes, '.wav'
-        finally:
-            os.unlink(audio_path)
+    if filename.endswith(VIDEO_FORMATS):
+        audio_bytes = await extract_audio_from_video(file)
+        return audio_bytes, '.wav'
     
     # Audio formats - use directly
-    audio_formats = ['.mp3', '.wav', '.m4a', '.webm', '.ogg', '.flac']
-    if any(filename.endswith(fmt) for fmt in audio_formats):
+    if filename.endswith(AUDIO_FORMATS):
         audio_bytes = await file.read()
         ext = os.path.splitext(filename)[1]
         return audio_bytes, ext
     
     raise HTTPException(
         status_code=400,
-        detail=f"Unsupported file format. Supported: {', '.join(audio_formats + video_formats)}"
+        detail=f"Unsupported file format. Supported: {', '.join(AUDIO_FORMATS + VIDEO_FORMATS)}"
     )
 
 
@@ -120,12 +162,9 @@ def get_file_info(file: UploadFile) -> dict:
     """Get information about uploaded file"""
     filename = file.filename.lower()
     
-    video_formats = ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv']
-    audio_formats = ['.mp3', '.wav', '.m4a', '.webm', '.ogg', '.flac']
-    
-    if any(filename.endswith(fmt) for fmt in video_formats):
+    if filename.endswith(VIDEO_FORMATS):
         file_type = 'video'
-    elif any(filename.endswith(fmt) for fmt in audio_formats):
+    elif filename.endswith(AUDIO_FORMATS):
         file_type = 'audio'
     else:
         file_type = 'unknown'
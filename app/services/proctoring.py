@@ -1,11 +1,20 @@
 from typing import List, Dict
+from collections import deque
 from datetime import datetime
 from app.models import ProctoringEvent
+import orjson
 import uuid
 
 # In-memory storage for proctoring events
 PROCTORING_EVENTS: List[Dict] = []
 
+# Events kept per session for the report's "detailed_events"
+RECENT_EVENTS = 10
+
+# Identical events (same type and details) within one window of this many
+# seconds are counted once; webcam checks re-send the same event per frame
+DEDUP_WINDOW_SECONDS = 2
+
 class ProctoringEngine:
     def __init__(self):
         self.sessions = {}
@@ -18,15 +27,22 @@ class ProctoringEngine:
     
     def start_proctoring_session(self, session_id: str) -> Dict:
         """Initialize proctoring for an exam session."""
+        # Counts are kept per type as events arrive, so only the most recent
+        # events need to be held for the report.
         self.sessions[session_id] = {
             "started_at": datetime.now(),
-            "events": [],
+            "events": deque(maxlen=RECENT_EVENTS),
+            "total_events": 0,
             "flags": {
                 "tab_switch": 0,
                 "face_not_detected": 0,
                 "multiple_faces": 0,
                 "suspicious_object": 0
             },
+            "risk_score": 0.0,  # kept in step with flags by log_proctoring_event
+            # (type, details) keys seen in the current dedup window
+            "dedup_window": None,
+            "dedup_keys": set(),
             "risk_level": "low"
         }
         return {"status": "proctoring_started", "session_id": session_id}
@@ -38,6 +54,13 @@ class ProctoringEngine:
         if session_id not in self.sessions:
             return {"error": "Session not found"}
         
+        if self._is_duplicate(self.sessions[session_id], event):
+            return {
+                "status": "duplicate_ignored",
+                "current_risk_level": self.sessions[session_id]["risk_level"],
+                "flags": self.sessions[session_id]["flags"]
+            }
+        
         # Record the event
         self.sessions[session_id]["events"].append({
             "type": event.event_type,
@@ -45,10 +68,15 @@ class ProctoringEngine:
             "confidence": event.confidence,
             "details": event.details
         })
+        self.sessions[session_id]["total_events"] += 1
         
-        # Update flag counts
-        if event.event_type in self.sessions[session_id]["flags"]:
-            self.sessions[session_id]["flags"][event.event_type] += 1
+        # Update flag counts and the risk score they imply
+        flags = self.sessions[session_id]["flags"]
+        if event.event_type in flags:
+            flags[event.event_type] += 1
+            self.sessions[session_id]["risk_score"] += self._risk_delta(
+                event.event_type, flags[event.event_type]
+            )
         
         # Assess risk level
         risk_level = self._assess_risk_level(session_id)
@@ -60,18 +88,37 @@ class ProctoringEngine:
             "flags": self.sessions[session_id]["flags"]
         }
     
+    def _is_duplicate(self, session_data: Dict, event: ProctoringEvent) -> bool:
+        """True if the same event was already logged in the current window."""
+        window = int(event.timestamp.timestamp()) // DEDUP_WINDOW_SECONDS
+        if window != session_data["dedup_window"]:
+            # Keys from earlier windows can never match again
+            session_data["dedup_window"] = window
+            session_data["dedup_keys"] = set()
+        
+        details = orjson.dumps(event.details, option=orjson.OPT_SORT_KEYS, default=str) if event.details else None
+        key = (event.event_type, details)
+        if key in session_data["dedup_keys"]:
+            return True
+        session_data["dedup_keys"].add(key)
+        return False
+    
+    def _risk_delta(self, event_type: str, count: int) -> float:
+        """Change in risk score when a flag's count goes from count - 1 to count.
+
+        Each flag scores count * 0.5 up to its threshold and
+        (count - threshold) * 2 beyond it.
+        """
+        threshold = self.risk_thresholds.get(event_type, 5)
+        if count <= threshold:
+            return 0.5
+        if count == threshold + 1:
+            return 2 - threshold * 0.5
+        return 2
+    
     def _assess_risk_level(self, session_id: str) -> str:
         """Assess the overall risk level for a proctoring session."""
-        flags = self.sessions[session_id]["flags"]
-        
-        # Calculate risk score
-        risk_score = 0
-        for event_type, count in flags.items():
-            threshold = self.risk_thresholds.get(event_type, 5)
-            if count > threshold:
-                risk_score += (count - threshold) * 2
-            else:
-                risk_score += count * 0.5
+        risk_score = self.sessions[session_id]["risk_score"]
         
         # Determine risk level
         if risk_score < 5:
@@ -89,11 +136,12 @@ class ProctoringEngine:
         session_data = self.sessions[session_id]
         
         # Categorize events
+        flags = session_data["flags"]
         event_summary = {
-            "tab_switches": len([e for e in session_data["events"] if e["type"] == "tab_switch"]),
-            "face_detection_issues": len([e for e in session_data["events"] if e["type"] == "face_not_detected"]),
-            "multiple_faces_detected": len([e for e in session_data["events"] if e["type"] == "multiple_faces"]),
-            "suspicious_objects": len([e for e in session_data["events"] if e["type"] == "suspicious_object"]),
+            "tab_switches": flags["tab_switch"],
+            "face_detection_issues": flags["face_not_detected"],
+            "multiple_faces_detected": flags["multiple_faces"],
+            "suspicious_objects": flags["suspicious_object"],
         }
         
         # Generate integrity score (0-100)
@@ -108,10 +156,10 @@ class ProctoringEngine:
             "risk_level": session_data["risk_level"],
             "integrity_score": integrity_score,
             "event_summary": event_summary,
-            "total_events": len(session_data["events"]),
+            "total_events": session_data["total_events"],
             "flags": session_data["flags"],
             "recommendations": recommendations,
-            "detailed_events": session_data["events"][-10:]  # Last 10 events
+            "detailed_events": list(session_data["events"])  # Last 10 events
         }
     
     def _calculate_integrity_score(self, session_data: Dict) -> int:
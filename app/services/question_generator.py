@@ -1,8 +1,15 @@
+import asyncio
 import uuid
 import os
-import json
+import random
+import re
 from typing import List, Dict, Optional
-from app.models import GeneratedQuestion, MCQOption
+import orjson
+from app.models import QUESTION_LIST, GeneratedQuestion, MCQOption, normalize_text
+from app.services.admission import llm_gate
+from app.services.batcher import MicroBatcher, question_batch_handler
+from app.services.cache import question_cache
+from fastapi import HTTPException
 
 # Try to import OpenAI
 try:
@@ -12,6 +19,18 @@ except ImportError:
     OPENAI_AVAILABLE = False
     print("OpenAI not installed. Run: pip install openai")
 
+# Built on first use and shared, so calls reuse one connection pool
+_openai_client = None
+_openai_key: Optional[str] = None
+
+
+def get_openai_client(api_key: str) -> "AsyncOpenAI":
+    global _openai_client, _openai_key
+    if _openai_client is None or _openai_key != api_key:
+        _openai_client = AsyncOpenAI(api_key=api_key)
+        _openai_key = api_key
+    return _openai_client
+
 
 # ============================================================================
 # AI-Powered Question Generation (Production)
@@ -29,9 +48,17 @@ async def generate_questions_from_text(
     api_key = os.environ.get("OPENAI_API_KEY")
     
     if api_key and OPENAI_AVAILABLE:
+        cached = await question_cache.get(text, num_questions, mix or {})
+        if cached is not None:
+            return cached
+
         print("Using OpenAI GPT-4 for question generation...")
         try:
-            return await generate_questions_with_openai(text, num_questions, mix, api_key)
+            questions = await generate_questions_with_openai(text, num_questions, mix, api_key)
+            await question_cache.put(text, num_questions, mix or {}, questions)
+            return questions
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"OpenAI generation failed: {e}")
             print("Falling back to template-based generation...")
@@ -44,6 +71,10 @@ async def generate_questions_from_text(
         return await generate_questions_template_based(text, num_questions, mix)
 
 
+# Coalesces concurrent generate-questions calls before they reach the LLM
+qgen_batcher = MicroBatcher(question_batch_handler(generate_questions_from_text), max_batch=8, max_wait_ms=50)
+
+
 async def generate_questions_with_openai(
     text: str,
     num_questions: int = 10,
@@ -52,6 +83,10 @@ async def generate_questions_with_openai(
 ) -> List[GeneratedQuestion]:
     """
     Generate high-quality questions using OpenAI GPT-4.
+
+    Each question type is requested in its own concurrent call, so latency
+    tracks the slowest type rather than one long completion. The calls share
+    a single admission slot, so one lecture can't take over the LLM gate.
     """
     if mix is None:
         mix = {
@@ -60,7 +95,44 @@ async def generate_questions_with_openai(
             "short_answer": int(num_questions * 0.2),
         }
     
-    client = AsyncOpenAI(api_key=api_key)
+    client = get_openai_client(api_key)
+    
+    async with llm_gate.slot():
+        results = await asyncio.gather(
+            *(_request_questions(client, text, chunk) for chunk in _split_mix(mix)),
+            return_exceptions=True,
+        )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    
+    # Separate calls can still land on the same question
+    questions = []
+    seen_prompts = set()
+    for q in (q for chunk_questions in results for q in chunk_questions):
+        key = normalize_text(q.prompt)
+        if key not in seen_prompts:
+            seen_prompts.add(key)
+            questions.append(q)
+    print(f"✓ Generated {len(questions)} AI-powered questions")
+    return questions
+
+
+def _split_mix(mix: Dict[str, int]) -> List[Dict[str, int]]:
+    """Split a question mix into one single-type mix per requested type."""
+    chunks = []
+    for qtype in ("mcq", "fill_blank", "short_answer"):
+        count = mix.get(qtype, 0)
+        if count > 0:
+            chunk = {"mcq": 0, "fill_blank": 0, "short_answer": 0}
+            chunk[qtype] = count
+            chunks.append(chunk)
+    return chunks
+
+
+async def _request_questions(client, text: str, mix: Dict[str, int]) -> List[GeneratedQuestion]:
+    """One chat completion for the questions in `mix`."""
+    num_questions = sum(mix.values())
     
     # Create the prompt
     prompt = f"""You are an expert educator creating exam questions from lecture content.
@@ -123,7 +195,7 @@ Return ONLY a valid JSON array with this exact structure:
 CRITICAL: Return ONLY the JSON array, no other text."""
 
     try:
-        # Call OpenAI API
+        # Call OpenAI API (the caller holds the llm_gate slot)
         response = await client.chat.completions.create(
             model="gpt-4-turbo-preview",  # or "gpt-4" or "gpt-3.5-turbo"
             messages=[
@@ -147,34 +219,27 @@ CRITICAL: Return ONLY the JSON array, no other text."""
         content = content.strip()
         
         # Parse JSON
-        questions_data = json.loads(content)
+        questions_data = orjson.loads(content)
         
-        # Convert to GeneratedQuestion objects
-        questions = []
-        for q_data in questions_data:
-            # Convert options if present
-            options = None
-            if q_data.get("options"):
-                options = [
-                    MCQOption(text=opt["text"], is_correct=opt.get("is_correct", False))
-                    for opt in q_data["options"]
-                ]
-            
-            question = GeneratedQuestion(
-                type=q_data["type"],
-                prompt=q_data["prompt"],
-                options=options,
-                answer=q_data["answer"],
-                explanation=q_data.get("explanation"),
-                topic=q_data.get("topic"),
-                difficulty=q_data.get("difficulty", "medium"),
-            )
-            questions.append(question)
+        # Convert to GeneratedQuestion objects (option dicts are coerced to MCQOption).
+        # Only the content fields are taken from the model; ids are always
+        # assigned here, since each per-type call tends to emit "q1", "q2", ...
+        questions = QUESTION_LIST.validate_python([
+            {
+                "type": q_data.get("type"),
+                "prompt": q_data.get("prompt"),
+                "options": q_data.get("options"),
+                "answer": q_data.get("answer"),
+                "explanation": q_data.get("explanation"),
+                "topic": q_data.get("topic"),
+                "difficulty": q_data.get("difficulty", "medium"),
+            }
+            for q_data in questions_data
+        ])
         
-        print(f"✓ Generated {len(questions)} AI-powered questions")
         return questions
         
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"Failed to parse OpenAI response as JSON: {e}")
         print(f"Response was: {content[:500]}")
         raise Exception("OpenAI returned invalid JSON")
@@ -202,30 +267,23 @@ async def generate_questions_template_based(
             "short_answer": int(num_questions * 0.2),
         }
     
-    questions = []
+    # (count, generator) per question type, generated in this order
+    plan = [
+        (mix.get("mcq", 0), generate_mcq_question),
+        (mix.get("fill_blank", 0), generate_fill_blank_question),
+        (mix.get("short_answer", 0), generate_short_answer_question),
+    ]
     concepts = extract_concepts(text, num_questions * 2)
     difficulties = ["easy", "medium", "hard"]
     
-    # Generate MCQ questions
-    for i in range(mix.get("mcq", 0)):
-        concept = concepts[i % len(concepts)]
-        difficulty = difficulties[i % 3]
-        question = generate_mcq_question(concept, difficulty)
-        questions.append(question)
-    
-    # Generate fill-in-the-blank
-    for i in range(mix.get("fill_blank", 0)):
-        concept = concepts[(i + mix["mcq"]) % len(concepts)]
-        difficulty = difficulties[i % 3]
-        question = generate_fill_blank_question(concept, difficulty)
-        questions.append(question)
-    
-    # Generate short answer
-    for i in range(mix.get("short_answer", 0)):
-        concept = concepts[(i + mix["mcq"] + mix["fill_blank"]) % len(concepts)]
-        difficulty = difficulties[i % 3]
-        question = generate_short_answer_question(concept, difficulty)
-        questions.append(question)
+    # One pass over a list sized up front; concepts rotate across all types,
+    # difficulties within each type
+    questions: List[GeneratedQuestion] = [None] * sum(count for count, _ in plan)
+    idx = 0
+    for count, generate in plan:
+        for i in range(count):
+            questions[idx] = generate(concepts[idx % len(concepts)], difficulties[i % 3])
+            idx += 1
     
     print(f"✓ Generated {len(questions)} template-based questions")
     return questions
@@ -236,7 +294,8 @@ async def summarize_text(text: str) -> str:
     if not text:
         return "No content provided"
     
-    words = text.split()
+    # Only the first 50 words are needed; leave the rest of the text unsplit
+    words = text.split(maxsplit=50)
     if len(words) > 50:
         summary = ' '.join(words[:50]) + "..."
     else:
@@ -248,13 +307,24 @@ async def summarize_text(text: str) -> str:
 # Helper Functions (for template-based generation)
 # ============================================================================
 
+COMMON_WORDS = frozenset({"the", "a", "an", "and", "or", "but", "in", "on", "at", "to", "for", "is", "was", "are", "of", "it", "that", "this"})
+
+# Runs of 6+ letters (any script); punctuation and digits split words
+_LONG_WORD = re.compile(r"[^\W\d_]{6,}")
+
+
 def extract_concepts(text: str, num_concepts: int = 5) -> List[str]:
-    """Extract key concepts from text."""
-    words = text.lower().split()
-    common_words = {"the", "a", "an", "and", "or", "but", "in", "on", "at", "to", "for", "is", "was", "are", "of", "it", "that", "this"}
-    concepts = [w for w in words if len(w) > 5 and w not in common_words]
+    """Extract key concepts from text (the first distinct long words)."""
+    # Stops scanning as soon as enough concepts are found
+    seen: Dict[str, None] = {}
+    for match in _LONG_WORD.finditer(text):
+        if len(seen) >= num_concepts:
+            break
+        word = match.group().lower()
+        if word not in COMMON_WORDS:
+            seen[word] = None
     
-    unique_concepts = list(set(concepts))[:num_concepts]
+    unique_concepts = list(seen)
     
     if not unique_concepts:
         unique_concepts = ["concept", "principle", "topic"]
@@ -262,32 +332,57 @@ def extract_concepts(text: str, num_concepts: int = 5) -> List[str]:
     return unique_concepts
 
 
+# Shuffles template MCQ options so the correct one isn't always first
+_rng = random.Random()
+
+# Distractor endings for template MCQs ("<Concept> is primarily decorative", ...)
+_INCORRECT_SUFFIXES = (
+    "is primarily decorative",
+    "has no practical applications",
+    "is an outdated approach",
+)
+
+# Template prompts/answers per difficulty; only the chosen one is formatted
+_MCQ_PROMPTS = {
+    "easy": "What is the primary purpose of {concept}?",
+    "medium": "How does {concept} function in practical applications?",
+    "hard": "Analyze the implications of {concept} in complex scenarios.",
+}
+# Fill-in-the-blank prompts don't mention the concept (it is the answer)
+_FILL_BLANK_PROMPTS = {
+    "easy": "The _____ is essential for understanding this topic.",
+    "medium": "In modern applications, _____ plays a critical role.",
+    "hard": "Advanced implementations leverage _____ to achieve optimal results.",
+}
+_SHORT_ANSWER_PROMPTS = {
+    "easy": "Briefly describe {concept}.",
+    "medium": "Explain how {concept} is applied in real-world scenarios.",
+    "hard": "Critically evaluate the role of {concept} in solving complex problems.",
+}
+_SHORT_ANSWERS = {
+    "easy": "A concise explanation of {concept}",
+    "medium": "Practical applications of {concept}",
+    "hard": "Critical analysis of {concept}",
+}
+
+
 def generate_mcq_question(concept: str, difficulty: str) -> GeneratedQuestion:
     """Generate an MCQ question."""
-    prompts = {
-        "easy": f"What is the primary purpose of {concept}?",
-        "medium": f"How does {concept} function in practical applications?",
-        "hard": f"Analyze the implications of {concept} in complex scenarios.",
-    }
-    
-    correct_opt = MCQOption(
-        text=f"{concept.capitalize()} enables efficient processing and optimization",
-        is_correct=True
-    )
-    
-    incorrect_opts = [
-        MCQOption(text=f"{concept.capitalize()} is primarily decorative", is_correct=False),
-        MCQOption(text=f"{concept.capitalize()} has no practical applications", is_correct=False),
-        MCQOption(text=f"{concept.capitalize()} is an outdated approach", is_correct=False),
+    name = concept.capitalize()
+    answer = f"{name} enables efficient processing and optimization"
+    # Built from our own strings, so skip per-option validation
+    options = [MCQOption.model_construct(text=answer, is_correct=True)]
+    options += [
+        MCQOption.model_construct(text=f"{name} {suffix}", is_correct=False)
+        for suffix in _INCORRECT_SUFFIXES
     ]
-    
-    options = [correct_opt] + incorrect_opts
+    _rng.shuffle(options)
     
     return GeneratedQuestion(
         type="mcq",
-        prompt=prompts.get(difficulty, prompts["medium"]),
+        prompt=_MCQ_PROMPTS.get(difficulty, _MCQ_PROMPTS["medium"]).format(concept=concept),
         options=options,
-        answer=correct_opt.text,
+        answer=answer,
         explanation=f"The correct answer explains how {concept} functions in the context discussed.",
         topic=concept,
         difficulty=difficulty,
@@ -296,15 +391,9 @@ def generate_mcq_question(concept: str, difficulty: str) -> GeneratedQuestion:
 
 def generate_fill_blank_question(concept: str, difficulty: str) -> GeneratedQuestion:
     """Generate a fill-in-the-blank question."""
-    prompts = {
-        "easy": f"The _____ is essential for understanding this topic.",
-        "medium": f"In modern applications, _____ plays a critical role.",
-        "hard": f"Advanced implementations leverage _____ to achieve optimal results.",
-    }
-    
     return GeneratedQuestion(
         type="fill_blank",
-        prompt=prompts.get(difficulty, prompts["medium"]),
+        prompt=_FILL_BLANK_PROMPTS.get(difficulty, _FILL_BLANK_PROMPTS["medium"]),
         options=None,
         answer=concept,
         explanation=f"The blank should be filled with '{concept}' based on the lecture context.",
@@ -315,23 +404,11 @@ def generate_fill_blank_question(concept: str, difficulty: str) -> GeneratedQues
 
 def generate_short_answer_question(concept: str, difficulty: str) -> GeneratedQuestion:
     """Generate a short answer question."""
-    prompts = {
-        "easy": f"Briefly describe {concept}.",
-        "medium": f"Explain how {concept} is applied in real-world scenarios.",
-        "hard": f"Critically evaluate the role of {concept} in solving complex problems.",
-    }
-    
-    answers = {
-        "easy": f"A concise explanation of {concept}",
-        "medium": f"Practical applications of {concept}",
-        "hard": f"Critical analysis of {concept}",
-    }
-    
     return GeneratedQuestion(
         type="short_answer",
-        prompt=prompts.get(difficulty, prompts["medium"]),
+        prompt=_SHORT_ANSWER_PROMPTS.get(difficulty, _SHORT_ANSWER_PROMPTS["medium"]).format(concept=concept),
         options=None,
-        answer=answers.get(difficulty, answers["medium"]),
+        answer=_SHORT_ANSWERS.get(difficulty, _SHORT_ANSWERS["medium"]).format(concept=concept),
         explanation=f"A strong answer should demonstrate understanding of {concept} as discussed in the lecture.",
         topic=concept,
         difficulty=difficulty,
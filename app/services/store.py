@@ -0,0 +1,291 @@
+"""
+Lecture / session storage shared by every API worker.
+
+SESSION_PROVIDER selects the backend: "redis" (the default when REDIS_URL is
+set) keeps records in Redis as JSON so several uvicorn/gunicorn workers see
+the same data; "memory" uses an in-process dict, which is fine for local
+development with a single worker. Both backends expire records after the
+store's TTL (SETEX on Redis; in memory, expired records are dropped when
+read and swept on every write), so abandoned sessions don't accumulate.
+
+Records fetched from the dict backend are the stored objects themselves; from
+Redis they are fresh copies. Callers must therefore always `await put_*()`
+after mutating a record.
+
+With SESSION_WRITE_BACK_MS > 0 the Redis session store becomes write-back:
+writes land in an in-process hot cache and a background task flushes dirty
+sessions to Redis in one pipeline per interval. That takes Redis off the
+/answer path, at the cost of other workers seeing a session up to one
+interval late, so only enable it behind sticky (per-session) routing.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Generic, List, Optional, Tuple, Type, TypeVar
+
+import orjson
+from pydantic import BaseModel
+
+from app.models import MAX_PROCTORING_FLAGS, Lecture, TestSession
+
+# Optional: Redis backend for multi-worker deployments
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+REDIS_URL = os.environ.get("REDIS_URL")
+SESSION_PROVIDER = os.environ.get("SESSION_PROVIDER", "redis" if REDIS_URL else "memory")
+LECTURE_TTL = int(os.environ.get("LECTURE_TTL_SECONDS", 7 * 24 * 3600))
+SESSION_TTL = int(os.environ.get("SESSION_TTL_SECONDS", 2 * 3600))
+SESSION_WRITE_BACK_MS = float(os.environ.get("SESSION_WRITE_BACK_MS", 0))
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class ModelStore(Generic[M]):
+    """Async key/value store of Pydantic models, keyed by record id."""
+
+    def __init__(
+        self,
+        model: Type[M],
+        prefix: str,
+        ttl: Optional[int] = None,
+        client=None,
+        write_back_ms: float = 0,
+        hot_size: int = 10_000,
+    ):
+        self.model = model
+        self.prefix = prefix
+        self.ttl = ttl
+        self.client = client
+        # record_id -> (expires_at, record); expires_at is None without a TTL.
+        # Every write moves its key to the end and the TTL is fixed, so the
+        # dict stays ordered by expiry and the sweep only looks at the front.
+        self._local: Dict[str, Tuple[Optional[float], M]] = {}
+
+        # Write-back mode (Redis only): LRU of recently used records, plus the
+        # records written since the last flush
+        self.write_back = client is not None and write_back_ms > 0
+        self.flush_interval = write_back_ms / 1000
+        self.hot_size = hot_size
+        self._hot: "OrderedDict[str, M]" = OrderedDict()
+        self._dirty: Dict[str, M] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def _local_get(self, record_id: str) -> Optional[M]:
+        item = self._local.get(record_id)
+        if item is None:
+            return None
+        expires_at, record = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._local[record_id]
+            return None
+        return record
+
+    def _sweep_local(self, now: float) -> None:
+        """Drop expired records from the front of the (expiry-ordered) dict."""
+        local = self._local
+        while local:
+            record_id = next(iter(local))
+            if local[record_id][0] > now:
+                return
+            del local[record_id]
+
+    def _remember(self, record_id: str, record: M) -> None:
+        self._hot[record_id] = record
+        self._hot.move_to_end(record_id)
+        excess = len(self._hot) - self.hot_size
+        if excess > 0:
+            # Least recently used first, but never a record that is still
+            # waiting to be flushed: Redis only has an older copy of it
+            clean = (key for key in self._hot if key not in self._dirty)
+            for key in list(islice(clean, excess)):
+                del self._hot[key]
+
+    async def get(self, record_id: str) -> Optional[M]:
+        if self.client is None:
+            return self._local_get(record_id)
+
+        if self.write_back:
+            record = self._hot.get(record_id)
+            if record is not None:
+                self._hot.move_to_end(record_id)
+                return record
+            record = self._dirty.get(record_id)
+            if record is not None:
+                self._remember(record_id, record)
+                return record
+
+        raw = await self.client.get(self.prefix + record_id)
+        if raw is None:
+            return None
+        record = self.model.model_validate_json(raw)
+        if self.write_back:
+            self._remember(record_id, record)
+        return record
+
+    async def set(self, record_id: str, record: M) -> None:
+        if self.client is None:
+            if not self.ttl:
+                self._local[record_id] = (None, record)
+                return
+            now = time.monotonic()
+            self._local.pop(record_id, None)
+            self._local[record_id] = (now + self.ttl, record)
+            self._sweep_local(now)
+            return
+
+        if self.write_back:
+            self._dirty[record_id] = record
+            self._remember(record_id, record)
+            if self._flusher is None:
+                self._flusher = asyncio.create_task(self._flush_loop())
+            return
+
+        payload = orjson.dumps(record.model_dump())
+        if self.ttl:
+            await self.client.setex(self.prefix + record_id, self.ttl, payload)
+        else:
+            await self.client.set(self.prefix + record_id, payload)
+
+    async def flush(self) -> None:
+        """Write every dirty record to Redis in one pipeline."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        pipe = self.client.pipeline(transaction=False)
+        for record_id, record in dirty.items():
+            payload = orjson.dumps(record.model_dump())
+            if self.ttl:
+                pipe.setex(self.prefix + record_id, self.ttl, payload)
+            else:
+                pipe.set(self.prefix + record_id, payload)
+        try:
+            await pipe.execute()
+        except Exception:
+            # Keep them for the next flush unless they were written again meanwhile
+            for record_id, record in dirty.items():
+                self._dirty.setdefault(record_id, record)
+            raise
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ {self.prefix} write-back flush failed: {e}")
+
+    async def close(self) -> None:
+        """Stop the flusher and write out anything still pending."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self.write_back:
+            await self.flush()
+
+    async def contains(self, record_id: str) -> bool:
+        if self.client is None:
+            return self._local_get(record_id) is not None
+        if self.write_back and (record_id in self._hot or record_id in self._dirty):
+            return True
+        return bool(await self.client.exists(self.prefix + record_id))
+
+    async def values(self) -> List[M]:
+        """Return every stored record (scans the key space on Redis)."""
+        if self.client is None:
+            records = (self._local_get(record_id) for record_id in list(self._local))
+            return [record for record in records if record is not None]
+
+        if self.write_back:
+            await self.flush()
+
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + "*", count=500)]
+        if not keys:
+            return []
+        return [
+            self.model.model_validate_json(raw)
+            for raw in await self.client.mget(keys)
+            if raw is not None
+        ]
+
+
+redis_client = None
+if SESSION_PROVIDER == "redis":
+    if REDIS_AVAILABLE and REDIS_URL:
+        redis_client = aioredis.from_url(REDIS_URL)
+    else:
+        print("⚠️ SESSION_PROVIDER=redis needs REDIS_URL and the redis package; using memory store")
+
+# Global store instances
+lectures_store: ModelStore[Lecture] = ModelStore(Lecture, "lec:", ttl=LECTURE_TTL, client=redis_client)
+sessions_store: ModelStore[TestSession] = ModelStore(
+    TestSession, "sess:", ttl=SESSION_TTL, client=redis_client, write_back_ms=SESSION_WRITE_BACK_MS
+)
+
+
+async def get_lecture(lecture_id: str) -> Optional[Lecture]:
+    return await lectures_store.get(lecture_id)
+
+
+# Bumped on every lecture write so list caches can tell they are stale
+lectures_version = 0
+
+
+async def put_lecture(lecture: Lecture) -> None:
+    global lectures_version
+    await lectures_store.set(lecture.id, lecture)
+    lectures_version += 1
+
+
+async def get_session(session_id: str) -> Optional[TestSession]:
+    return await sessions_store.get(session_id)
+
+
+async def put_session(session: TestSession) -> None:
+    await sessions_store.set(session.id, session)
+
+
+# Proctoring flags arrive concurrently with answers. On Redis they live in
+# their own keys (a capped list of flags and a hash of per-type counts) so
+# neither side rewrites a stale copy of the whole session; in memory the
+# stored session is updated in place.
+FLAGS_KEY = "sess-flags:"
+FLAG_COUNTS_KEY = "sess-flag-counts:"
+
+
+async def add_proctoring_flags(session_id: str, flags: List[dict]) -> None:
+    if redis_client is None:
+        session = await sessions_store.get(session_id)
+        if session is not None:
+            session.add_proctoring_flags(flags)
+        return
+
+    counts: Dict[str, int] = {}
+    for flag in flags:
+        counts[flag["type"]] = counts.get(flag["type"], 0) + 1
+
+    flags_key = FLAGS_KEY + session_id
+    counts_key = FLAG_COUNTS_KEY + session_id
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.rpush(flags_key, *(orjson.dumps(flag) for flag in flags))
+    pipe.ltrim(flags_key, -MAX_PROCTORING_FLAGS, -1)
+    for flag_type, n in counts.items():
+        pipe.hincrby(counts_key, flag_type, n)
+    pipe.expire(flags_key, SESSION_TTL)
+    pipe.expire(counts_key, SESSION_TTL)
+    await pipe.execute()
+
+
+async def close_stores() -> None:
+    """Flush write-back stores; call on shutdown."""
+    await sessions_store.close()
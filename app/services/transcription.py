@@ -1,6 +1,16 @@
-from fastapi import UploadFile
+from fastapi import UploadFile, HTTPException
+import asyncio
+import bisect
+import io
 import os
-from typing import Optional
+import random
+import re
+from typing import BinaryIO, List, Optional, Union
+
+import httpx
+
+from app.services.admission import transcription_gate
+from app.services.batcher import MicroBatcher
 
 # Try to import AssemblyAI
 try:
@@ -11,33 +21,86 @@ except ImportError:
     print("⚠️ AssemblyAI not installed. Run: pip install assemblyai")
 
 
+# Optional self-hosted batched transcription service (e.g. a faster-whisper
+# BatchedInferencePipeline) that accepts several "files" parts and returns
+# {"results": [{"text": ...}, ...]}. When set, it is used instead of AssemblyAI.
+TRANSCRIBE_BATCH_URL = os.environ.get("TRANSCRIBE_BATCH_URL")
+# Upload-size bucket edges in bytes, a cheap proxy for clip duration: each
+# request to the service only carries clips of similar length, so the
+# model pads less when it stacks them.
+SIZE_BUCKETS = (1 << 20, 4 << 20, 16 << 20, 64 << 20)
+
+ASSEMBLYAI_API_KEY = os.environ.get("ASSEMBLYAI_API_KEY")
+
+# Which backend transcribe_audio uses, resolved once from the configuration
+if TRANSCRIBE_BATCH_URL:
+    TRANSCRIBE_STRATEGY = "batch"
+elif ASSEMBLYAI_AVAILABLE and ASSEMBLYAI_API_KEY:
+    TRANSCRIBE_STRATEGY = "assemblyai"
+else:
+    TRANSCRIBE_STRATEGY = "placeholder"
+    if ASSEMBLYAI_AVAILABLE:
+        print("⚠️ No ASSEMBLYAI_API_KEY found, using placeholder transcription")
+
+# Runs of whitespace collapsed by format_transcript
+_WHITESPACE = re.compile(r'\s+')
+
+# AssemblyAI status polling: exponential backoff (seconds) with +/-20% jitter
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 10.0
+
+_batch_http: Optional[httpx.AsyncClient] = None
+
+# Built on first use and shared, so uploads reuse its HTTP connection pool
+_transcriber = None
+_transcriber_key: Optional[str] = None
+
+
+def get_transcriber(api_key: str):
+    global _transcriber, _transcriber_key
+    if _transcriber is None or _transcriber_key != api_key:
+        aai.settings.api_key = api_key
+        _transcriber = aai.Transcriber()
+        _transcriber_key = api_key
+    return _transcriber
+
+
 async def transcribe_audio(file: UploadFile) -> str:
     """
-    Transcribe audio file to text using AssemblyAI.
+    Transcribe audio file to text using the batched service
+    (TRANSCRIBE_BATCH_URL) or AssemblyAI.
     """
-    # Read file content
-    content = await file.read()
     filename = file.filename or "audio_file"
-    file_size = len(content)
     
-    # Check for AssemblyAI API key and library
-    api_key = os.environ.get("ASSEMBLYAI_API_KEY")
+    if TRANSCRIBE_STRATEGY == "batch":
+        # The upload stays open while this request awaits its batch result.
+        await file.seek(0)
+        return await transcription_batcher.submit(
+            (filename, file.file, file.content_type, upload_size(file))
+        )
     
-    if not ASSEMBLYAI_AVAILABLE:
-        print("⚠️ AssemblyAI library not installed")
-        return generate_placeholder_transcript(filename, file_size)
-    
-    if api_key:
+    if TRANSCRIBE_STRATEGY == "assemblyai":
         try:
             print(f"Transcribing {filename} with AssemblyAI...")
-            return await transcribe_with_assemblyai(content, filename, api_key)
+            # The SDK streams the spooled upload itself; no copy to disk
+            await file.seek(0)
+            return await transcribe_file_with_assemblyai(file.file, filename, ASSEMBLYAI_API_KEY)
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"AssemblyAI transcription failed: {e}")
             print("Falling back to placeholder transcription")
-            return generate_placeholder_transcript(filename, file_size)
-    else:
-        print("No ASSEMBLYAI_API_KEY found, using placeholder transcription")
-        return generate_placeholder_transcript(filename, file_size)
+    
+    return generate_placeholder_transcript(filename, upload_size(file))
+
+
+def upload_size(file: UploadFile) -> int:
+    """Size of an upload in bytes, without reading it into memory."""
+    if file.size is not None:
+        return file.size
+    size = file.file.seek(0, os.SEEK_END)
+    file.file.seek(0)
+    return size
 
 
 async def transcribe_with_assemblyai(content: bytes, filename: str, api_key: str) -> str:
@@ -47,53 +110,130 @@ async def transcribe_with_assemblyai(content: bytes, filename: str, api_key: str
     if not ASSEMBLYAI_AVAILABLE:
         raise Exception("AssemblyAI library not installed. Run: pip install assemblyai")
     
-    # Configure AssemblyAI
-    aai.settings.api_key = api_key
-    
-    # Create temporary file
-    import tempfile
+    return await transcribe_file_with_assemblyai(io.BytesIO(content), filename, api_key)
+
+
+async def transcribe_with_assemblyai_advanced(
+    file: UploadFile,
+    api_key: Optional[str],
+    speaker_labels: bool = False,
+    auto_chapters: bool = False,
+) -> str:
+    """
+    Transcribe an upload with optional AssemblyAI features (speaker
+    diarization, auto chapters). The upload is streamed to AssemblyAI,
+    never read into memory whole.
+    """
+    if not (ASSEMBLYAI_AVAILABLE and api_key):
+        raise HTTPException(
+            status_code=500,
+            detail="Speaker labels and auto chapters need AssemblyAI (ASSEMBLYAI_API_KEY).",
+        )
     
-    # Get file extension
-    extension = filename.split('.')[-1] if '.' in filename else 'mp3'
+    filename = file.filename or "audio_file"
+    config = aai.TranscriptionConfig(speaker_labels=speaker_labels, auto_chapters=auto_chapters)
+    await file.seek(0)
+    return await transcribe_file_with_assemblyai(file.file, filename, api_key, config)
+
+
+async def transcribe_file_with_assemblyai(
+    data: Union[str, BinaryIO], filename: str, api_key: str, config=None
+) -> str:
+    """
+    Transcribe a file path or binary file object with AssemblyAI.
+
+    The upload and each status check are blocking SDK calls, so they run in
+    a worker thread; between checks the job waits on the event loop with
+    exponential backoff. Each job holds a transcription_gate slot while it
+    polls.
+    """
+    if not ASSEMBLYAI_AVAILABLE:
+        raise Exception("AssemblyAI library not installed. Run: pip install assemblyai")
     
-    # Save to temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{extension}') as temp_file:
-        temp_file.write(content)
-        temp_path = temp_file.name
+    transcriber = get_transcriber(api_key)
     
-    try:
-        # Create transcriber
-        transcriber = aai.Transcriber()
-        
+    async with transcription_gate.slot():
         print(f"Uploading {filename} to AssemblyAI...")
-        
-        # Transcribe the file
-        transcript = transcriber.transcribe(temp_path)
+        transcript = await asyncio.to_thread(transcriber.submit, data, config)
         
         # Wait for transcription to complete
-        if transcript.status == aai.TranscriptStatus.error:
-            raise Exception(f"Transcription failed: {transcript.error}")
-        
-        print(f"✓ Transcribed {filename} successfully")
-        print(f"  Duration: {transcript.audio_duration}s")
-        print(f"  Words: {len(transcript.words) if transcript.words else 0}")
-        
-        return transcript.text
-        
-    finally:
-        # Clean up temp file
-        import os
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        delay = POLL_INITIAL_DELAY
+        while transcript.status not in (aai.TranscriptStatus.completed, aai.TranscriptStatus.error):
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, POLL_MAX_DELAY)
+            transcript = await asyncio.to_thread(aai.Transcript.get_by_id, transcript.id)
+    
+    if transcript.status == aai.TranscriptStatus.error:
+        raise Exception(f"Transcription failed: {transcript.error}")
+    
+    print(f"✓ Transcribed {filename} successfully")
+    print(f"  Duration: {transcript.audio_duration}s")
+    print(f"  Words: {len(transcript.words) if transcript.words else 0}")
+    
+    return transcript.text
 
 
-def generate_placeholder_transcript(filename: str, file_size: int) -> str:
-    """
-    Generate placeholder when API key not available.
-    """
-    transcript = f"""This is a placeholder transcription for: {filename}
+async def _post_batch(uploads: List[tuple]) -> List[object]:
+    global _batch_http
+    if _batch_http is None:
+        _batch_http = httpx.AsyncClient(
+            timeout=300,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+        )
+
+    files = [("files", (name, fileobj, content_type)) for name, fileobj, content_type, _ in uploads]
+    resp = await _batch_http.post(TRANSCRIBE_BATCH_URL, files=files)
+    if resp.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"Transcription service error: {resp.text}")
+    results = resp.json().get("results", [])
+    if len(results) != len(uploads):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Batch transcription returned {len(results)} results for {len(uploads)} files.",
+        )
+    return [
+        r.get("text") or r.get("transcript")
+        or HTTPException(status_code=500, detail="No transcript returned.")
+        for r in results
+    ]
+
+
+async def _transcribe_batch(uploads: List[tuple]) -> List[object]:
+    """Split a batch into size buckets and send one service request per bucket."""
+    buckets: dict = {}
+    for i, upload in enumerate(uploads):
+        buckets.setdefault(bisect.bisect(SIZE_BUCKETS, upload[3]), []).append(i)
+
+    groups = list(buckets.values())
+    replies = await asyncio.gather(
+        *(_post_batch([uploads[i] for i in group]) for group in groups),
+        return_exceptions=True,
+    )
 
-File size: {file_size / 1024:.1f} KB
+    results: List[object] = [None] * len(uploads)
+    for group, reply in zip(groups, replies):
+        for pos, i in enumerate(group):
+            results[i] = reply if isinstance(reply, BaseException) else reply[pos]
+    return results
+
+
+transcription_batcher = MicroBatcher(_transcribe_batch, max_batch=8, max_wait_ms=50)
+
+
+async def shutdown_transcription() -> None:
+    """Stop the batch worker and close its HTTP client."""
+    global _batch_http
+    await transcription_batcher.stop()
+    if _batch_http is not None:
+        await _batch_http.aclose()
+        _batch_http = None
+
+
+# Built once; only the file name and size are filled in per request
+_PLACEHOLDER_TEMPLATE = """This is a placeholder transcription for: {filename}
+
+File size: {size_kb:.1f} KB
 
 To enable real AssemblyAI transcription:
 1. Install: pip install assemblyai
@@ -126,21 +266,24 @@ Best practices include:
 - Regularly update the knowledge base with new information
 
 The future of conversational AI involves more sophisticated natural language processing, better context retention, emotional intelligence, and seamless integration across multiple channels and platforms.
-"""
-    
-    return transcript.strip()
+""".strip()
+
+
+def generate_placeholder_transcript(filename: str, file_size: int) -> str:
+    """
+    Generate placeholder when API key not available.
+    """
+    return _PLACEHOLDER_TEMPLATE.format(filename=filename, size_kb=file_size / 1024)
 
 
 def format_transcript(raw_transcript: str) -> str:
     """
     Clean and format transcription.
     """
-    import re
-    
     cleaned = raw_transcript.strip()
     
     # Remove excessive spaces
-    cleaned = re.sub(r'\s+', ' ', cleaned)
+    cleaned = _WHITESPACE.sub(' ', cleaned)
     
     # Ensure proper sentence endings
     if cleaned and not cleaned.endswith(('.', '!', '?')):